@@ -0,0 +1,173 @@
+#   FILE HEADER
+#       File Name:  ApiDecoder.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the typed decoding of QGenda API records into rows of the import.qdm_*
+#       tables.  It replaces the OPENJSON ... WITH parsing of the import.usp_*API procedures, so the type
+#       conversions run on the ETL host instead of the shared ETLServer.  Each loader declares the schema
+#       of its import table as a list of (API field, converter) pairs in column order; compileSchema()
+#       turns it into a function mapping one API record to one parameter tuple, and insertRecords() bulk
+#       inserts the tuples with BulkWriter.insertRows() (fast_executemany).
+#
+#   TECHNICAL Notes
+#       - The converters reproduce the conversions of the *API procedures, including their quirks, so the
+#         rows written are the same as before and the change detection does not flag every record:
+#           - JSON true/false are read as the text 'true'/'false' (OPENJSON); toFlag() maps 'true' to 'T'
+#             and anything else, NULL included, to 'F'
+#           - A flag read into a column too short for 'true' (NCHAR(1) in usp_ScheduleAPI) is truncated
+#             before the test and always becomes 'F'; toTruncatedFlag(length) keeps that result
+#           - Strings longer than the column are truncated, as CONVERT does
+#           - An empty string converted to DATE/DATETIME becomes 1900-01-01, and to an integer 0
+#           - SMALLDATETIME values are rounded to the minute the way SQL Server rounds them
+#       - A value that SQL Server could not convert (malformed GUID or date) raises ValueError, which
+#         fails the loader as the OPENJSON error did
+#       - Records are decoded and inserted batchSize at a time, so a streamed payload (see JsonStream.py)
+#         is never decoded in full
+#       - insertRecords() commits every chunk (see BulkWriter.insertRows); rows the server rejects are
+#         skipped and reported in the returned listLog
+
+import BulkWriter
+import json
+import JsonStream
+import uuid
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+emptyDate = date(1900, 1, 1)
+
+# Text of a scalar JSON value as OPENJSON returns it; objects and arrays read as NULL
+def _jsonText(value):
+	if value is None or isinstance(value, (dict, list)):
+		return None
+	if isinstance(value, bool):
+		return "true" if value else "false"
+	if isinstance(value, str):
+		return value
+	return json.dumps(value)
+
+def _parseDatetime(text):
+	text = text.replace(" ", "T").rstrip("Z")
+	if "." in text:
+		# Python before 3.11 only parses 3 or 6 fractional digits
+		whole, fraction = text.split(".", 1)
+		text = whole + "." + (fraction + "000000")[:6]
+	return datetime.fromisoformat(text)
+
+def toGuid(value):
+	text = _jsonText(value)
+	return None if text is None else str(uuid.UUID(text)).upper()
+
+def toInt(value):
+	text = _jsonText(value)
+	if text is None:
+		return None
+	return int(Decimal(text.strip() or "0"))
+
+def toFlag(value):
+	return "T" if _jsonText(value) == "true" else "F"
+
+# toFlag() on a value first truncated to length characters, as OPENJSON did for a too short column
+def toTruncatedFlag(length):
+	def convert(value):
+		text = _jsonText(value)
+		return "T" if text is not None and text[:length] == "true" else "F"
+	return convert
+
+# The JSON fragment of an object or array (OPENJSON ... AS JSON); scalars read as NULL
+def toJson(value):
+	return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else None
+
+# Reads the first length characters of the value as a date
+def toDate(length=10):
+	def convert(value):
+		text = _jsonText(value)
+		if text is None:
+			return None
+		text = text[:length].strip()
+		return _parseDatetime(text).date() if text else emptyDate
+	return convert
+
+def toTime(value):
+	text = _jsonText(value)
+	if text is None:
+		return None
+	text = text.split("T")[-1]
+	return time.fromisoformat(text[:12] if len(text) > 8 and text[8] == "." else text[:8])
+
+# Reads the first length characters of the value as a date and time
+def toDatetime(length=23):
+	def convert(value):
+		text = _jsonText(value)
+		if text is None:
+			return None
+		text = text[:length].strip()
+		return _parseDatetime(text) if text else datetime.combine(emptyDate, time())
+	return convert
+
+# Same as toDatetime(), rounded to the minute: 29.998 seconds round down, 29.999 round up
+def toSmallDatetime(length=19):
+	parse = toDatetime(length)
+	def convert(value):
+		value = parse(value)
+		if value is None:
+			return None
+		if value.second * 1000000 + value.microsecond >= 29999000:
+			value += timedelta(minutes=1)
+		return value.replace(second=0, microsecond=0)
+	return convert
+
+def toDecimal(scale):
+	quantum = Decimal(1).scaleb(-scale)
+	def convert(value):
+		text = _jsonText(value)
+		return None if text is None else Decimal(text).quantize(quantum, rounding=ROUND_HALF_UP)
+	return convert
+
+def toText(maxLength, emptyAsNull=False):
+	def convert(value):
+		text = _jsonText(value)
+		if text is None or (emptyAsNull and text == ""):
+			return None
+		return text[:maxLength]
+	return convert
+
+# Looks the text of the value up in mapping; values not in mapping become default
+def toMapped(mapping, default=None):
+	def convert(value):
+		return mapping.get(_jsonText(value), default)
+	return convert
+
+def constant(result):
+	def convert(value):
+		return result
+	return convert
+
+# Returns a function that turns one API record (dictionary) into a row tuple in schema order
+def compileSchema(schema):
+	pairs = tuple(schema)
+	def decode(record):
+		get = record.get
+		return tuple([convert(get(field)) for field, convert in pairs])
+	return decode
+
+# Decodes records with schema and bulk inserts them into tableName; returns (rows inserted, rows decoded, listLog)
+#	catalogTableName is the table whose column types tableName copies (a temp table is not in the catalog)
+def insertRecords(cursor, tableName, schema, records, batchSize=5000, catalogTableName=None):
+	decode = compileSchema(schema)
+	sql = "INSERT INTO " + tableName + " VALUES (" + ", ".join("?" * len(schema)) + ")"
+
+	rowsInserted = 0
+	rowsDecoded = 0
+	listLog = []
+	for batch in JsonStream.batched(records, batchSize):
+		rows = [decode(record) for record in batch]
+		rowsDecoded += len(rows)
+		inserted, insertLog = BulkWriter.insertRows(cursor, sql, rows, tableName, batchSize, catalogTableName)
+		rowsInserted += inserted
+		listLog.extend(insertLog)
+
+	return rowsInserted, rowsDecoded, listLog
+
+# END OF FILE
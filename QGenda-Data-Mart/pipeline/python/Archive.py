@@ -0,0 +1,207 @@
+#   FILE HEADER
+#       File Name:  Archive.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the archive of the raw QGenda API payloads.  The loaders used to write
+#       each payload to an uncompressed <Entity>_<date>.json file before any database work started, and
+#       a rerun on the same day overwrote it.  The loaders now hand the payload to the archive writer,
+#       which compresses and writes it on a background thread while the loader carries on.
+#
+#   TECHNICAL Notes
+#       - Archive files are named <Entity>_<run timestamp>[_<part>].json.gz; every file of a run shares
+#         the timestamp taken when the writer was created, so reruns never overwrite each other
+#       - A file is written as <name>.tmp and renamed when it is complete, so a crash never leaves a
+#         truncated archive under its final name
+#       - ArchiveFile.write() accepts text or bytes and only queues them; the queue is bounded, so a
+#         loader waits when the disk falls behind instead of buffering the payload twice
+#       - Archive errors are logged by close() and never fail a loader.  A file left by an exception
+#         inside its with block is discarded, so a failed download is not archived as complete
+#       - prune() deletes archives (and the older uncompressed .json snapshots) past the retention period
+#       - The module-level open()/close()/prune() use one shared writer for the run, created on first use;
+#         setting enabled = False (replay runs) turns open() into a no-op
+#       - Files opened with the endpoint URL they hold are listed in Manifest_<run timestamp>.json together
+#         with the run parameters given to setParameters(); Replay.py serves the payloads back by URL
+
+import builtins
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+archivePath = os.path.join("C:\\", "Users", "Public", "ANES ETL", "QGenda Data Mart", "json", "")
+enabled = True
+
+class ArchiveFile:
+	def __init__(self, writer, fileName, endPointURL=None):
+		self.writer = writer
+		self.fileName = fileName
+		self.endPointURL = endPointURL
+
+	def write(self, data):
+		self.writer._queue.put(("write", self, data))
+
+	def close(self):
+		self.writer._queue.put(("close", self, None))
+
+	# Drops the partial archive, e.g. when the download failed part way
+	def discard(self):
+		self.writer._queue.put(("discard", self, None))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.discard()
+
+# Stands in for an ArchiveFile when archiving is disabled
+class NullArchiveFile:
+	def write(self, data):
+		pass
+
+	def close(self):
+		pass
+
+	def discard(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		pass
+
+class ArchiveWriter:
+	def __init__(self, path=archivePath, queueSize=64, compressLevel=6):
+		self.path = path
+		self.compressLevel = compressLevel
+		self.runStamp = datetime.today().strftime("%Y-%m-%d_%H%M%S")
+
+		self._queue = queue.Queue(maxsize=queueSize)
+		self._files = {}		# ArchiveFile -> open gzip file
+		self._errors = []		# (file name, exception)
+		self._manifest = {}		# endPointURL -> file name
+		self.parameters = {}
+		self._written = 0
+		self._thread = threading.Thread(target=self._run, name="ArchiveWriter", daemon=True)
+		self._thread.start()
+
+	def open(self, entityName, part=None, endPointURL=None):
+		fileName = entityName + "_" + self.runStamp + ("_" + str(part) if part else "") + ".json.gz"
+		archiveFile = ArchiveFile(self, fileName, endPointURL)
+		self._queue.put(("open", archiveFile, None))
+		return archiveFile
+
+	def _run(self):
+		while True:
+			action, archiveFile, data = self._queue.get()
+			if action == "stop":
+				break
+			try:
+				if action == "open":
+					os.makedirs(self.path, exist_ok=True)
+					self._files[archiveFile] = gzip.open(self.path + archiveFile.fileName + ".tmp", "wb", compresslevel=self.compressLevel)
+				elif archiveFile in self._files:
+					if action == "write":
+						self._files[archiveFile].write(data.encode("utf-8") if isinstance(data, str) else data)
+					elif action == "discard":
+						self._files.pop(archiveFile).close()
+						os.remove(self.path + archiveFile.fileName + ".tmp")
+					else:
+						self._files.pop(archiveFile).close()
+						os.replace(self.path + archiveFile.fileName + ".tmp", self.path + archiveFile.fileName)
+						self._written += 1
+						if archiveFile.endPointURL is not None:
+							self._manifest[archiveFile.endPointURL] = archiveFile.fileName
+			except Exception as error:
+				# The archive of this payload is abandoned; its partial .tmp file is left for prune()
+				file = self._files.pop(archiveFile, None)
+				if file is not None:
+					file.close()
+				self._errors.append((archiveFile.fileName, error))
+
+	# Waits for every queued write, writes the run manifest and stops the writer; returns log entries
+	def close(self):
+		self._queue.put(("stop", None, None))
+		self._thread.join()
+
+		listLog = []
+		if self._manifest:
+			try:
+				fileName = self.path + "Manifest_" + self.runStamp + ".json"
+				# builtins.open: open() in this module is the archive open() below
+				with builtins.open(fileName + ".tmp", "w", encoding="utf-8") as file:
+					json.dump({"runStamp": self.runStamp, "parameters": self.parameters, "files": self._manifest}, file, indent=1)
+				os.replace(fileName + ".tmp", fileName)
+			except OSError as error:
+				self._errors.append(("Manifest_" + self.runStamp + ".json", error))
+		log = "(" + str(datetime.today()) + f")  {self._written} API payloads archived to {self.path}\n"
+		listLog.append(log)
+		for fileName, error in self._errors:
+			log = "(" + str(datetime.today()) + f")  WARNING:  Archive {fileName} could not be written: {error!r}\n"
+			listLog.append(log)
+		for archiveFile in list(self._files):
+			log = "(" + str(datetime.today()) + f")  WARNING:  Archive {archiveFile.fileName} was never closed and is incomplete\n"
+			listLog.append(log)
+			self._files.pop(archiveFile).close()
+		return listLog
+
+_writer = None
+_writerLock = threading.Lock()
+
+def _getWriter():
+	global _writer
+	with _writerLock:
+		if _writer is None:
+			_writer = ArchiveWriter()
+		return _writer
+
+def open(entityName, part=None, endPointURL=None):
+	if not enabled:
+		return NullArchiveFile()
+	return _getWriter().open(entityName, part, endPointURL)
+
+# Run parameters stored in the manifest (JSON-serializable values)
+def setParameters(parameters):
+	if enabled:
+		_getWriter().parameters.update(parameters)
+
+def close():
+	global _writer
+	with _writerLock:
+		writer, _writer = _writer, None
+	return writer.close() if writer is not None else []
+
+# Deletes archive files older than retentionDays; returns log entries
+def prune(retentionDays, path=archivePath):
+	cutoff = time.time() - retentionDays * 86400
+	filesDeleted = 0
+	listLog = []
+	try:
+		entries = list(os.scandir(path))
+	except OSError:
+		return listLog
+
+	for entry in entries:
+		if not entry.is_file() or not entry.name.endswith((".json", ".json.gz", ".json.gz.tmp")):
+			continue
+		try:
+			if entry.stat().st_mtime < cutoff:
+				os.remove(entry.path)
+				filesDeleted += 1
+		except OSError as error:
+			log = "(" + str(datetime.today()) + f")  WARNING:  Archive {entry.name} could not be deleted: {error!r}\n"
+			listLog.append(log)
+
+	log = "(" + str(datetime.today()) + f")  {filesDeleted} archive files older than {retentionDays} days deleted\n"
+	listLog.append(log)
+	return listLog
+
+# END OF FILE
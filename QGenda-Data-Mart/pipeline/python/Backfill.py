@@ -0,0 +1,108 @@
+#   FILE HEADER
+#       File Name:  Backfill.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the historical backfill of the date-windowed loaders (Schedule,
+#       TimeEvent), run by QGendaBackfill.py.  An arbitrary date range is split into calendar month
+#       partitions; the partitions are loaded concurrently by the usual loader, each over its own
+#       month, and every completed partition is checkpointed so a failed backfill resumes where it
+#       stopped instead of reloading the whole range.
+#
+#   TECHNICAL Notes
+#       - loadPartition(partitionStart, partitionEnd) runs the loader over one partition and returns its
+#         (status code, listLog), like every loader; QGendaBackfill.py calls the loaders with isolated=True
+#         (each partition imports into its own session temp table) and isFullWindow=False (the digest
+#         sidecar is updated, not replaced, and no rolling window state is touched)
+#       - Checkpoints are kept in the "Backfill" RunState under <Entity>_<startDate>_<endDate>.  Running
+#         the same backfill again skips the partitions already completed; the checkpoint is removed once
+#         every partition has completed, and restart=True discards it
+#       - Only the calling thread writes the checkpoint, as each partition completes
+#       - A partition that raises is reported as failed with its traceback, as in Pipeline.runLoaders()
+#       - Partition logs are returned in date order, not completion order
+
+import concurrent.futures
+import RunState
+import traceback
+from datetime import datetime, timedelta
+
+# Splits [startDate, endDate] into (partitionStart, partitionEnd) calendar months; the first and last may be partial
+def getMonthPartitions(startDate, endDate):
+	partitions = []
+	partitionStart = startDate
+	while partitionStart <= endDate:
+		nextMonth = (partitionStart.replace(day=1) + timedelta(days=32)).replace(day=1)
+		partitionEnd = min(nextMonth - timedelta(days=1), endDate)
+		partitions.append((partitionStart, partitionEnd))
+		partitionStart = nextMonth
+	return partitions
+
+def _runPartition(loadPartition, partitionStart, partitionEnd):
+	try:
+		return loadPartition(partitionStart, partitionEnd)
+	except (Exception, SystemExit):
+		log = "(" + str(datetime.today()) + f")  Partition {str(partitionStart)} to {str(partitionEnd)} raised an exception\n" + traceback.format_exc()
+		print(log)
+		return 400, [log]
+
+# Loads every month of [startDate, endDate] not yet checkpointed, maxWorkers partitions at a time; returns (status code, listLog)
+def runBackfill(entityName, loadPartition, startDate, endDate, maxWorkers=4, restart=False):
+	backfillKey = entityName + "_" + str(startDate) + "_" + str(endDate)
+	partitions = getMonthPartitions(startDate, endDate)
+	listLog = []
+
+	state = RunState.load("Backfill")
+	if restart:
+		state.pop(backfillKey, None)
+	checkpoint = state.setdefault(backfillKey, {"started": RunState.fromDatetime(datetime.today()), "partitions": {}})
+	RunState.save("Backfill", state)
+
+	pending = [(partitionStart, partitionEnd) for partitionStart, partitionEnd in partitions if str(partitionStart) not in checkpoint["partitions"]]
+
+	log = "(" + str(datetime.today()) + f")  {entityName} backfill from {str(startDate)} to {str(endDate)}:  {str(len(partitions))} month partitions, {str(len(partitions) - len(pending))} already completed, {str(len(pending))} to load with up to {str(maxWorkers)} at a time\n\n"
+	print(log)
+	listLog.append(log)
+
+	results = {}		# partitionStart -> (status, listLog)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+		futures = {executor.submit(_runPartition, loadPartition, partitionStart, partitionEnd): (partitionStart, partitionEnd) for partitionStart, partitionEnd in pending}
+
+		for future in concurrent.futures.as_completed(futures):
+			partitionStart, partitionEnd = futures[future]
+			status, partitionLog = future.result()
+			results[partitionStart] = (status, partitionLog)
+
+			if status == 200:
+				checkpoint["partitions"][str(partitionStart)] = {"partitionEnd": str(partitionEnd), "completed": RunState.fromDatetime(datetime.today())}
+				RunState.save("Backfill", state)
+				log = "(" + str(datetime.today()) + f")  {entityName} partition {str(partitionStart)} to {str(partitionEnd)} completed and checkpointed\n"
+			else:
+				log = "(" + str(datetime.today()) + f")  {entityName} partition {str(partitionStart)} to {str(partitionEnd)} failed\n"
+			print(log)
+
+	failedPartitions = []
+	for partitionStart, partitionEnd in pending:
+		status, partitionLog = results[partitionStart]
+		log = "(" + str(datetime.today()) + f")  Partition {str(partitionStart)} to {str(partitionEnd)}\n"
+		listLog.append(log)
+		listLog.extend(partitionLog)
+		if status != 200:
+			failedPartitions.append((partitionStart, partitionEnd))
+
+	if failedPartitions:
+		log = "(" + str(datetime.today()) + f")  {str(len(failedPartitions))} of {str(len(partitions))} partitions failed; run the same backfill again to resume from the checkpoint\n"
+		print(log)
+		listLog.append(log)
+		return 400, listLog
+
+	# Completed backfills are forgotten, so the same range can be backfilled again later
+	state.pop(backfillKey, None)
+	RunState.save("Backfill", state)
+
+	log = "(" + str(datetime.today()) + f")  {entityName} backfill from {str(startDate)} to {str(endDate)} complete\n"
+	print(log)
+	listLog.append(log)
+	return 200, listLog
+
+# END OF FILE
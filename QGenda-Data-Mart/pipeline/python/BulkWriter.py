@@ -0,0 +1,471 @@
+#   FILE HEADER
+#       File Name:  BulkWriter.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the set-based write helpers shared by the QGenda Data Mart loaders.
+#       deleteKeys() removes a set of records from a table by key in one statement per chunk of keys,
+#       replacing the loops that issued one DELETE (and one network round trip) per record.
+#       insertRows() writes a list of rows with pyodbc's array binding (fast_executemany) in bounded
+#       chunks, so each chunk is a single round trip instead of one per row.  copyRows() streams the
+#       result of a SELECT on one server into a table on another: a reader thread pulls batches with
+#       fetchmany() while the calling thread writes the previous batches, so memory stays at a few
+#       batches and the read and write round trips overlap.  readStagedChanges() reads the flagged rows
+#       of a stage table once and routes each row to the keys to delete from prod, the rows to insert, or
+#       both.  upsertRows() applies a change set to a prod table atomically: the rows and the keys to
+#       delete are bulk loaded into session temp tables, then one batch deletes, updates and inserts
+#       inside a single transaction, so report queries never see a half-applied push.
+#       refreshByShadowSwap() replaces a whole dimension: the imported snapshot is streamed into the
+#       table's shadow copy and switched in with a metadata-only ALTER TABLE ... SWITCH.
+#
+#   TECHNICAL Notes
+#       - Keys are shipped as chunked IN lists of parameter markers.  SQL Server accepts at most 2100
+#         parameters per statement, so chunks default to 1000 keys
+#       - Duplicate keys are removed before chunking (TagStaff and TagTask have one staged row per tag
+#         but delete by StaffKey/TaskKey)
+#       - Table and column names are concatenated into the statement the same way the loaders build
+#         their own SQL; only the key values are parameters
+#       - deleteKeys() does not commit; the caller commits after the last chunk, as before
+#       - insertRows() sets the parameter types and sizes from the target table's catalog entry, so
+#         pyodbc does not guess them from the first row (a NULL or short string in the first row would
+#         otherwise truncate or reject later rows).  When the table is not found in the catalog or its
+#         width does not match the rows, pyodbc's own type detection is used
+#       - insertRows() commits after every chunk and must be called with no uncommitted work pending on
+#         the connection.  When a chunk fails it is rolled back and retried one row at a time; rows that
+#         still fail are skipped and reported in the returned listLog
+#       - copyRows() writes each batch the same way as insertRows().  The reader and writer each use
+#         their own connection, so no pyodbc connection is shared between threads.  The queue between
+#         them holds at most queueSize batches; the reader waits when the writer falls behind
+#       - readStagedChanges() expects ETLCommand as the first column of the pending result set.  Rows are
+#         de-duplicated in Python in first-seen order, replacing SELECT DISTINCT over every column
+#       - upsertRows() creates its temp tables with SELECT TOP 0 ... INTO from the target table, so they
+#         have the target's column types.  The temp table loads are committed chunk by chunk (they touch
+#         nothing outside the session); the apply batch runs with XACT_ABORT ON and is committed once.
+#         Rows rejected while loading the temp table are counted, logged and left out of the push.
+#         NOCOUNT and XACT_ABORT are session options of the pooled connection, so they are turned off
+#         again after the batch: under NOCOUNT cursor.rowcount is -1, which deleteKeys() relies on
+#       - replaceRows() deletes keys and inserts their replacement rows the same way, in one batch.  A
+#         deleted record whose replacement could not be loaded would be lost, so when any row is rejected
+#         by the temp table load nothing is applied
+#       - When upsertRows() is given the changed columns per key, updated rows are grouped by their set
+#         of changed columns and each group gets its own narrow UPDATE, so a Notes-only change rewrites
+#         one column instead of the whole row.  Rows without an entry update every column
+#       - Temp tables are dropped before and after use because pooled connections outlive a loader
+#       - createTempTable() gives a loader a session copy of a working table (backfill partitions each
+#         load their own, see Backfill.py); insertRows() takes the catalog entry of the original table
+#         (catalogTableName) because the temp table is not in the database catalog
+#       - refreshByShadowSwap() requires <table>_Shadow to exist with identical columns and indexes (see
+#         the TABLE dim,*_Shadow.sql files).  Before the swap a single-row query compares the shadow and
+#         live row counts; the swap is refused when rows were rejected, the shadow is empty or it holds
+#         fewer than minRatio of the live rows.  TRUNCATE and SWITCH run in one transaction, so readers
+#         see either the old or the new dimension
+#       - Given a keyColumn, refreshByShadowSwap() carries the live records whose key is not in the
+#         snapshot over into the shadow table with one INSERT ... SELECT on the prod server, so records
+#         no longer returned by the source are kept, as the staging procedures keep them.
+#         requireLiveRows refuses the swap when the live table is empty
+
+import pyodbc
+import queue
+import threading
+import time
+from datetime import datetime
+
+maxParameters = 2100
+maxLoggedFailures = 10
+
+# Yields successive slices of at most chunkSize items
+def chunked(items, chunkSize):
+	for start in range(0, len(items), chunkSize):
+		yield items[start:start + chunkSize]
+
+# Deletes every record whose keyColumn is in keys; returns the number of rows deleted
+def deleteKeys(cursor, tableName, keyColumn, keys, chunkSize=1000):
+	if chunkSize < 1 or chunkSize >= maxParameters:
+		raise ValueError(f"chunkSize must be between 1 and {maxParameters - 1}")
+
+	uniqueKeys = list(dict.fromkeys(keys))
+	rowsDeleted = 0
+	for chunk in chunked(uniqueKeys, chunkSize):
+		markers = ", ".join("?" * len(chunk))
+		cursor.execute("DELETE FROM " + tableName + " WHERE " + keyColumn + " IN (" + markers + ");", *chunk)
+		if cursor.rowcount > 0:
+			rowsDeleted += cursor.rowcount
+
+	return rowsDeleted
+
+def _catalogColumns(cursor, tableName):
+	schema, table = tableName.split(".") if "." in tableName else (None, tableName)
+	return sorted(cursor.columns(table=table, schema=schema).fetchall(), key=lambda column: column.ordinal_position)
+
+# Returns the column names of "schema.table" in column order
+def getColumnNames(cursor, tableName):
+	return [column.column_name for column in _catalogColumns(cursor, tableName)]
+
+# Returns [(SQL type, column size, decimal digits)] for "schema.table" in column order, or None if not found
+def getInputSizes(cursor, tableName):
+	columns = _catalogColumns(cursor, tableName)
+	if not columns:
+		return None
+	# A column size of 0 binds (n)varchar(max) and varbinary(max) as streamed values
+	return [(column.data_type, column.column_size, column.decimal_digits) for column in columns]
+
+# Writes one chunk with array binding, falling back to row by row when the chunk fails; returns rows written
+def _writeChunk(cursor, sql, chunk, inputSizes, failures):
+	if inputSizes is not None:
+		cursor.setinputsizes(inputSizes)
+	try:
+		cursor.executemany(sql, chunk)
+		cursor.commit()
+		return len(chunk)
+	except pyodbc.Error:
+		cursor.rollback()
+
+	# Only the failing chunk is retried row by row
+	rowsWritten = 0
+	for row in chunk:
+		try:
+			cursor.execute(sql, row)
+			rowsWritten += 1
+		except pyodbc.Error as error:
+			failures.append((row, error))
+	cursor.commit()
+	return rowsWritten
+
+def _failureLog(failures, rowCount, tableName):
+	listLog = []
+	if failures:
+		target = tableName if tableName is not None else "target table"
+		log = "(" + str(datetime.today()) + f")  WARNING:  {len(failures)} of {rowCount} records could not be inserted into [{target}]\n"
+		listLog.append(log)
+		for row, error in failures[:maxLoggedFailures]:
+			listLog.append(f"    {tuple(row)}:  {error}\n")
+	return listLog
+
+# Returns the catalog input sizes for tableName when they fit rows of the given width, otherwise None
+def _matchingInputSizes(cursor, tableName, width):
+	inputSizes = getInputSizes(cursor, tableName) if tableName is not None else None
+	if inputSizes is not None and len(inputSizes) != width:
+		return None
+	return inputSizes
+
+# Inserts rows with array binding, chunkSize rows per round trip; returns (rows inserted, listLog)
+def insertRows(cursor, sql, rows, tableName=None, chunkSize=5000, catalogTableName=None):
+	if not rows:
+		return 0, []
+
+	inputSizes = _matchingInputSizes(cursor, catalogTableName or tableName, len(rows[0]))
+	cursor.fast_executemany = True
+	rowsInserted = 0
+	failures = []
+	try:
+		for chunk in chunked(rows, chunkSize):
+			rowsInserted += _writeChunk(cursor, sql, chunk, inputSizes, failures)
+	finally:
+		cursor.fast_executemany = False
+		cursor.setinputsizes(None)
+
+	return rowsInserted, _failureLog(failures, len(rows), tableName)
+
+# Streams the pending result set of sourceCursor into sql on destinationCursor; returns (rows read, rows inserted, listLog)
+def copyRows(sourceCursor, destinationCursor, sql, tableName=None, batchSize=5000, queueSize=4):
+	batches = queue.Queue(maxsize=queueSize)
+	stop = threading.Event()
+	readErrors = []
+
+	def read():
+		try:
+			while not stop.is_set():
+				rows = sourceCursor.fetchmany(batchSize)
+				if not rows:
+					break
+				batches.put(rows)
+		except Exception as error:
+			readErrors.append(error)
+		finally:
+			batches.put(None)
+
+	copyStart = time.perf_counter()
+	reader = threading.Thread(target=read, name="copyRows reader", daemon=True)
+	reader.start()
+
+	destinationCursor.fast_executemany = True
+	rowsRead = 0
+	rowsInserted = 0
+	failures = []
+	inputSizes = None
+	try:
+		while True:
+			rows = batches.get()
+			if rows is None:
+				break
+			if rowsRead == 0:
+				inputSizes = _matchingInputSizes(destinationCursor, tableName, len(rows[0]))
+			rowsRead += len(rows)
+			rowsInserted += _writeChunk(destinationCursor, sql, rows, inputSizes, failures)
+	finally:
+		destinationCursor.fast_executemany = False
+		destinationCursor.setinputsizes(None)
+		# Unblock the reader if the writer stopped early
+		stop.set()
+		while reader.is_alive():
+			try:
+				batches.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		reader.join()
+
+	if readErrors:
+		raise readErrors[0]
+
+	seconds = time.perf_counter() - copyStart
+	rate = rowsRead / seconds if seconds > 0 else 0.0
+	listLog = ["(" + str(datetime.today()) + f")  Copied {rowsInserted} of {rowsRead} records in {seconds:.3f}s ({rate:,.0f} rows/sec)\n"]
+	listLog.extend(_failureLog(failures, rowsRead, tableName))
+	return rowsRead, rowsInserted, listLog
+
+# Routes the pending stage rows (ETLCommand, columns...) by command; returns (delete keys, insert rows)
+def readStagedChanges(cursor, keyIndex, deleteCommands=("Update",), insertCommands=("New", "Update"), batchSize=5000):
+	deleteKeys = {}
+	insertRows = {}
+	while True:
+		rows = cursor.fetchmany(batchSize)
+		if not rows:
+			break
+		for row in rows:
+			command = row[0]
+			values = tuple(row)[1:]
+			if command in deleteCommands:
+				deleteKeys[values[keyIndex]] = None
+			if command in insertCommands:
+				insertRows[values] = None
+
+	return list(deleteKeys), list(insertRows)
+
+def _dropTempTables(cursor, names):
+	for name in names:
+		cursor.execute("IF OBJECT_ID('tempdb.." + name + "') IS NOT NULL DROP TABLE " + name + ";")
+	cursor.commit()
+
+# Turns off the session options set for a batch, so the pooled connection is lent out with the defaults
+def _resetSessionOptions(cursor):
+	cursor.execute("SET NOCOUNT OFF; SET XACT_ABORT OFF;")
+
+# Creates tempTableName as an empty session copy of tableName's columns
+def createTempTable(cursor, tempTableName, tableName):
+	_dropTempTables(cursor, [tempTableName])
+	cursor.execute("SELECT TOP 0 * INTO " + tempTableName + " FROM " + tableName + ";")
+	cursor.commit()
+
+def dropTempTable(cursor, tempTableName):
+	_dropTempTables(cursor, [tempTableName])
+
+# Loads rows into a temp table with array binding; returns rows rejected
+def _loadTempTable(cursor, tempTableName, rows, inputSizes, failures, chunkSize):
+	if not rows:
+		return 0
+	sql = "INSERT INTO " + tempTableName + " VALUES (" + ", ".join("?" * len(rows[0])) + ");"
+	cursor.fast_executemany = True
+	rowsLoaded = 0
+	try:
+		for chunk in chunked(rows, chunkSize):
+			rowsLoaded += _writeChunk(cursor, sql, chunk, inputSizes, failures)
+	finally:
+		cursor.fast_executemany = False
+		cursor.setinputsizes(None)
+	return len(rows) - rowsLoaded
+
+# Returns {key: row} for the records of tableName whose keyColumn is in keys
+def readRowsByKey(cursor, tableName, columns, keyColumn, keys, chunkSize=1000):
+	keyIndex = columns.index(keyColumn)
+	rowsByKey = {}
+	for chunk in chunked(list(dict.fromkeys(keys)), chunkSize):
+		markers = ", ".join("?" * len(chunk))
+		cursor.execute("SELECT " + ", ".join(columns) + " FROM " + tableName + " WHERE " + keyColumn + " IN (" + markers + ");", *chunk)
+		for row in cursor.fetchall():
+			rowsByKey[row[keyIndex]] = row
+	return rowsByKey
+
+# Deletes deleteKeys, updates rows whose key exists and inserts the rest, in one transaction; returns (deleted, updated, inserted, rejected, listLog)
+#	changedColumns maps key -> names of the columns that changed; those rows only update their changed columns
+def upsertRows(cursor, tableName, columns, keyColumn, rows, deleteKeys, changedColumns=None, chunkSize=5000):
+	rowsTable = "#upsertRows"
+	keysTable = "#upsertDeleteKeys"
+	_dropTempTables(cursor, [rowsTable, keysTable])
+
+	cursor.execute("SELECT TOP 0 " + ", ".join(columns) + ", CAST(0 AS int) AS UpsertGroup INTO " + rowsTable + " FROM " + tableName + ";")
+	cursor.execute("SELECT TOP 0 " + keyColumn + " INTO " + keysTable + " FROM " + tableName + ";")
+	cursor.commit()
+
+	# Group 0 updates every column, group -1 updates nothing, groups 1..n each update one set of changed columns
+	keyIndex = columns.index(keyColumn)
+	groups = {}			# tuple of column names -> group number
+	groupedRows = []
+	for row in rows:
+		group = 0
+		if changedColumns is not None and row[keyIndex] in changedColumns:
+			changed = tuple(column for column in columns if column in changedColumns[row[keyIndex]] and column != keyColumn)
+			group = groups.setdefault(changed, len(groups) + 1) if changed else -1
+		groupedRows.append(tuple(row) + (group,))
+
+	inputSizes = _matchingInputSizes(cursor, tableName, len(columns))
+	failures = []
+	rowsSizes = inputSizes + [(pyodbc.SQL_INTEGER, 0, 0)] if inputSizes is not None else None
+	rowsRejected = _loadTempTable(cursor, rowsTable, groupedRows, rowsSizes, failures, chunkSize)
+	keyRows = [(key,) for key in dict.fromkeys(deleteKeys)]
+	keySizes = [inputSizes[keyIndex]] if inputSizes is not None else None
+	rowsRejected += _loadTempTable(cursor, keysTable, keyRows, keySizes, failures, chunkSize)
+
+	updateGroups = [(0, [column for column in columns if column != keyColumn])]
+	updateGroups += [(group, list(changed)) for changed, group in groups.items()]
+	updateSql = ""
+	for group, updateColumns in updateGroups:
+		updateSql += """
+			UPDATE t
+			SET """ + ", ".join("t." + column + " = s." + column for column in updateColumns) + """
+			FROM """ + tableName + """ AS t
+				INNER JOIN """ + rowsTable + """ AS s ON s.""" + keyColumn + """ = t.""" + keyColumn + """
+			WHERE s.UpsertGroup = """ + str(group) + """;
+			SET @updated += @@ROWCOUNT;
+		"""
+
+	try:
+		cursor.execute("""
+			SET NOCOUNT ON;
+			SET XACT_ABORT ON;
+			DECLARE @deleted int, @updated int = 0, @inserted int;
+
+			DELETE t
+			FROM """ + tableName + """ AS t
+				INNER JOIN """ + keysTable + """ AS k ON k.""" + keyColumn + """ = t.""" + keyColumn + """;
+			SET @deleted = @@ROWCOUNT;
+			""" + updateSql + """
+			INSERT INTO """ + tableName + """ (""" + ", ".join(columns) + """)
+			SELECT """ + ", ".join("s." + column for column in columns) + """
+			FROM """ + rowsTable + """ AS s
+			WHERE NOT EXISTS (SELECT 1 FROM """ + tableName + """ AS t WHERE t.""" + keyColumn + """ = s.""" + keyColumn + """);
+			SET @inserted = @@ROWCOUNT;
+
+			SELECT @deleted, @updated, @inserted;
+		""")
+		rowsDeleted, rowsUpdated, rowsInserted = cursor.fetchone()
+		cursor.commit()
+	except pyodbc.Error:
+		cursor.rollback()
+		raise
+	finally:
+		try:
+			_resetSessionOptions(cursor)
+		finally:
+			_dropTempTables(cursor, [rowsTable, keysTable])
+
+	return rowsDeleted, rowsUpdated, rowsInserted, rowsRejected, _failureLog(failures, len(rows) + len(keyRows), tableName)
+
+# Deletes deleteKeys and inserts rows in one transaction, or applies nothing when a row is rejected; returns (deleted, inserted, rejected, listLog)
+def replaceRows(cursor, tableName, columns, keyColumn, rows, deleteKeys, chunkSize=5000):
+	rowsTable = "#replaceRows"
+	keysTable = "#replaceDeleteKeys"
+	_dropTempTables(cursor, [rowsTable, keysTable])
+
+	cursor.execute("SELECT TOP 0 " + ", ".join(columns) + " INTO " + rowsTable + " FROM " + tableName + ";")
+	cursor.execute("SELECT TOP 0 " + keyColumn + " INTO " + keysTable + " FROM " + tableName + ";")
+	cursor.commit()
+
+	try:
+		inputSizes = _matchingInputSizes(cursor, tableName, len(columns))
+		failures = []
+		rowsRejected = _loadTempTable(cursor, rowsTable, [tuple(row) for row in rows], inputSizes, failures, chunkSize)
+		keyRows = [(key,) for key in dict.fromkeys(deleteKeys)]
+		keySizes = [inputSizes[columns.index(keyColumn)]] if inputSizes is not None else None
+		rowsRejected += _loadTempTable(cursor, keysTable, keyRows, keySizes, failures, chunkSize)
+		listLog = _failureLog(failures, len(rows) + len(keyRows), tableName)
+		if rowsRejected:
+			return 0, 0, rowsRejected, listLog
+
+		try:
+			cursor.execute("""
+				SET NOCOUNT ON;
+				SET XACT_ABORT ON;
+				DECLARE @deleted int, @inserted int;
+
+				DELETE t
+				FROM """ + tableName + """ AS t
+					INNER JOIN """ + keysTable + """ AS k ON k.""" + keyColumn + """ = t.""" + keyColumn + """;
+				SET @deleted = @@ROWCOUNT;
+
+				INSERT INTO """ + tableName + """ (""" + ", ".join(columns) + """)
+				SELECT """ + ", ".join(columns) + """
+				FROM """ + rowsTable + """;
+				SET @inserted = @@ROWCOUNT;
+
+				SELECT @deleted, @inserted;
+			""")
+			rowsDeleted, rowsInserted = cursor.fetchone()
+			cursor.commit()
+		except pyodbc.Error:
+			cursor.rollback()
+			raise
+		finally:
+			_resetSessionOptions(cursor)
+	finally:
+		_dropTempTables(cursor, [rowsTable, keysTable])
+
+	return rowsDeleted, rowsInserted, rowsRejected, listLog
+
+# Streams sourceTableName into tableName's shadow table and switches it in; returns (swapped, listLog)
+def refreshByShadowSwap(sourceCursor, cursor, sourceTableName, tableName, minRatio=0.9, keyColumn=None, requireLiveRows=False):
+	listLog = []
+	shadowTableName = tableName + "_Shadow"
+	columns = getColumnNames(cursor, tableName)
+
+	cursor.execute("TRUNCATE TABLE " + shadowTableName + ";")
+	cursor.commit()
+
+	sourceCursor.execute("SELECT " + ", ".join(columns) + " FROM " + sourceTableName + ";")
+	sql = "INSERT INTO " + shadowTableName + " (" + ", ".join(columns) + ") VALUES (" + ", ".join("?" * len(columns)) + ");"
+	rowsRead, rowsInserted, copyLog = copyRows(sourceCursor, cursor, sql, shadowTableName)
+	listLog.extend(copyLog)
+
+	rowsCarried = 0
+	if keyColumn is not None:
+		cursor.execute("""
+			INSERT INTO """ + shadowTableName + """ (""" + ", ".join(columns) + """)
+			SELECT """ + ", ".join("t." + column for column in columns) + """
+			FROM """ + tableName + """ AS t
+			WHERE NOT EXISTS (SELECT 1 FROM """ + shadowTableName + """ AS s WHERE s.""" + keyColumn + """ = t.""" + keyColumn + """);
+		""")
+		rowsCarried = max(cursor.rowcount, 0)
+		cursor.commit()
+		log = "(" + str(datetime.today()) + f")  {rowsCarried} records of [{tableName}] not in the snapshot carried over into [{shadowTableName}]\n"
+		listLog.append(log)
+
+	cursor.execute("SELECT (SELECT COUNT_BIG(*) FROM " + shadowTableName + "), (SELECT COUNT_BIG(*) FROM " + tableName + ");")
+	shadowCount, liveCount = cursor.fetchone()
+	cursor.commit()
+
+	log = "(" + str(datetime.today()) + f")  Row count check:  {shadowCount} records in [{shadowTableName}], {liveCount} records in [{tableName}]\n"
+	listLog.append(log)
+
+	if rowsInserted != rowsRead or shadowCount != rowsRead + rowsCarried or shadowCount == 0 or shadowCount < liveCount * minRatio or (requireLiveRows and liveCount == 0):
+		log = "(" + str(datetime.today()) + f")  ERROR:  Row count check failed, [{tableName}] was not replaced\n"
+		listLog.append(log)
+		return False, listLog
+
+	try:
+		cursor.execute("""
+			SET XACT_ABORT ON;
+			TRUNCATE TABLE """ + tableName + """;
+			ALTER TABLE """ + shadowTableName + """ SWITCH TO """ + tableName + """;
+		""")
+		cursor.commit()
+	except pyodbc.Error:
+		cursor.rollback()
+		raise
+	finally:
+		_resetSessionOptions(cursor)
+
+	log = "(" + str(datetime.today()) + f")  [{shadowTableName}] switched into [{tableName}]\n"
+	listLog.append(log)
+	return True, listLog
+
+# END OF FILE
@@ -0,0 +1,90 @@
+#   FILE HEADER
+#       File Name:  Checkpoint.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the checkpoint of a QGendaMain.py run.  As each loader finishes, its
+#       outcome is written to the "QGendaRun" RunState: status, completion time, the ETL phases it went
+#       through (with the time each started) and the digest of the payload it loaded.  QGendaMain.py
+#       --resume reads the checkpoint of the last run and only runs the loaders that did not complete,
+#       so a rerun after a transient failure late in the run does not redo the whole pipeline.
+#
+#   TECHNICAL Notes
+#       - The checkpoint is saved after every loader, so it survives a run that is killed part way
+#       - Phases are read from the "ETL PHASE: <name>" entries every loader writes to its listLog; the
+#         phase start time is the timestamp of the first log entry after it
+#       - The failed phase is the one named by the "ETL PHASE FAILED: <name>" entry a loader writes before
+#         its clean-up phase (see EntityLoader.py), or its last phase when there is no such entry.  A loader
+#         that raised keeps its partial listLog (see Pipeline.py), so its failed phase is recorded too
+#       - A resumed loader restarts from its first phase: its import table may have been cleared by a
+#         later run and its refresh window has moved on, so the failed phase is recorded for the log
+#         but not resumed in place.  Every loader is safe to rerun
+#       - The payload digest is the one the dimension loaders keep in their <Entity>_payload RunState
+#         (see DiffEngine.py); Schedule and TimeEvent have none
+#       - A resumed run carries the completed loaders of the run it resumes, so a second failure can be
+#         resumed again without rerunning them
+
+import re
+import RunState
+from datetime import datetime
+
+stateName = "QGendaRun"
+_timestamp = re.compile(r"^\((\d{4}-\d{2}-\d{2} [0-9:.]+)\)")
+
+# Returns [{"phase", "started"}] for the ETL PHASE entries of a loader log
+def getPhases(listLog):
+	phases = []
+	for entry in listLog:
+		if "ETL PHASE:" in entry:
+			phases.append({"phase": entry.split("ETL PHASE:", 1)[1].strip(), "started": None})
+		elif phases and phases[-1]["started"] is None:
+			match = _timestamp.match(entry)
+			if match:
+				phases[-1]["started"] = match.group(1)
+	return phases
+
+# The phase a failed loader stopped in, or None
+def getFailedPhase(listLog, phases):
+	for entry in reversed(listLog):
+		if "ETL PHASE FAILED:" in entry:
+			return entry.split("ETL PHASE FAILED:", 1)[1].strip()
+	return phases[-1]["phase"] if phases else None
+
+# The checkpoint of the last run, or an empty dictionary
+def load():
+	return RunState.load(stateName)
+
+# Names of the loaders that completed in the checkpointed run
+def getCompleted(state):
+	return [name for name, loader in state.get("loaders", {}).items() if loader.get("status") == 200]
+
+# Starts the checkpoint of a new run; resuming carries over the completed loaders of previousState
+def start(processStart, previousState=None):
+	state = {"runStart": RunState.fromDatetime(processStart), "status": "running", "loaders": {}}
+	if previousState:
+		state["resumedFrom"] = previousState.get("resumedFrom") or previousState.get("runStart")
+		for name in getCompleted(previousState):
+			state["loaders"][name] = previousState["loaders"][name]
+	RunState.save(stateName, state)
+	return state
+
+# Records the outcome of one loader; status is None for a loader skipped because of a failed dependency
+def recordLoader(state, name, status, listLog):
+	phases = getPhases(listLog)
+	state["loaders"][name] = {
+		"status": status,
+		"completed": RunState.fromDatetime(datetime.today()),
+		"phases": phases,
+		"failedPhase": getFailedPhase(listLog, phases) if status != 200 else None,
+		"payloadDigest": RunState.load(name + "_payload").get("digest") if status == 200 else None,
+		"runStart": state["runStart"],
+	}
+	RunState.save(stateName, state)
+
+def finish(state, failed):
+	state["status"] = "failed" if failed else "complete"
+	state["runEnd"] = RunState.fromDatetime(datetime.today())
+	RunState.save(stateName, state)
+
+# END OF FILE
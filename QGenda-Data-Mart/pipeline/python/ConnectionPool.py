@@ -0,0 +1,166 @@
+#   FILE HEADER
+#       File Name:  ConnectionPool.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines a pool of pyodbc connections shared by all QGenda Data Mart loaders.
+#       QGendaMain.py creates a single pool and passes it to each loader, so a run opens one connection
+#       per DSN and concurrent loader instead of one per loader.  This file can only execute successfully
+#       in environments with ODBC connections defined that match the DSNs requested from the pool.
+#
+#   TECHNICAL Notes
+#       - Connections are keyed by (DSN, Database)
+#       - Connections are lent per thread: a thread that acquires the same key twice receives the same
+#         connection, and the connection returns to the pool when the thread releases it for the last time
+#       - Loaders borrow connections with lease() (with pool.lease(dsn, database) as connection:), which
+#         releases the connection even when the loader raises.  A lease that is never released would be
+#         inherited by the next loader run on the same thread, open transaction included
+#       - An idle connection is health checked with a trivial query before it is lent again and is
+#         replaced when the check fails
+#       - At most maxConnectionsPerKey connections are open per key; callers wait for a free connection
+#         and the time spent waiting is reported by getStats()
+
+import contextlib
+import pyodbc
+import threading
+import time
+from datetime import datetime
+
+class ConnectionPool:
+	def __init__(self, maxConnectionsPerKey=4, healthCheckSql="SELECT 1;"):
+		self.maxConnectionsPerKey = maxConnectionsPerKey
+		self.healthCheckSql = healthCheckSql
+
+		self._condition = threading.Condition()
+		self._idle = {}			# key -> [connection]
+		self._openCount = {}	# key -> number of open connections
+		self._leases = {}		# (thread id, key) -> [connection, depth]
+		self._keys = {}			# id(connection) -> key
+		self._stats = {}		# key -> {"opened", "acquired", "replaced", "waitSeconds", "maxWaitSeconds"}
+
+	def _connectionString(self, key):
+		dsn, database = key
+		if database is None:
+			return f"DSN={dsn};"
+		return f"DSN={dsn};Database={database};"
+
+	def _isHealthy(self, connection):
+		try:
+			cursor = connection.cursor()
+			cursor.execute(self.healthCheckSql)
+			cursor.fetchone()
+			cursor.close()
+			return True
+		except pyodbc.Error:
+			return False
+
+	def acquire(self, dsn, database=None):
+		key = (dsn, database)
+		leaseKey = (threading.get_ident(), key)
+
+		with self._condition:
+			stats = self._stats.setdefault(key, {"opened": 0, "acquired": 0, "replaced": 0, "waitSeconds": 0.0, "maxWaitSeconds": 0.0})
+			stats["acquired"] += 1
+
+			lease = self._leases.get(leaseKey)
+			if lease is not None:
+				lease[1] += 1
+				return lease[0]
+
+			waitStart = time.perf_counter()
+			while not self._idle.get(key) and self._openCount.get(key, 0) >= self.maxConnectionsPerKey:
+				self._condition.wait()
+			waitSeconds = time.perf_counter() - waitStart
+			stats["waitSeconds"] += waitSeconds
+			stats["maxWaitSeconds"] = max(stats["maxWaitSeconds"], waitSeconds)
+
+			connection = self._idle[key].pop() if self._idle.get(key) else None
+			if connection is None:
+				# Reserve the slot before connecting so other threads see the open count
+				self._openCount[key] = self._openCount.get(key, 0) + 1
+
+		# Network work happens outside the lock
+		if connection is not None and not self._isHealthy(connection):
+			try:
+				connection.close()
+			except pyodbc.Error:
+				pass
+			with self._condition:
+				del self._keys[id(connection)]
+				stats["replaced"] += 1
+			connection = None
+
+		if connection is None:
+			try:
+				connection = pyodbc.connect(self._connectionString(key))
+			except Exception:
+				with self._condition:
+					self._openCount[key] -= 1
+					self._condition.notify()
+				raise
+			with self._condition:
+				stats["opened"] += 1
+
+		with self._condition:
+			self._leases[leaseKey] = [connection, 1]
+			self._keys[id(connection)] = key
+
+		return connection
+
+	def release(self, connection):
+		with self._condition:
+			key = self._keys[id(connection)]
+			leaseKey = (threading.get_ident(), key)
+			lease = self._leases[leaseKey]
+			lease[1] -= 1
+			if lease[1] > 0:
+				return
+			del self._leases[leaseKey]
+
+		# Discard any uncommitted work so the next borrower starts clean
+		try:
+			connection.rollback()
+			healthy = True
+		except pyodbc.Error:
+			healthy = False
+
+		with self._condition:
+			if healthy:
+				self._idle.setdefault(key, []).append(connection)
+			else:
+				del self._keys[id(connection)]
+				self._openCount[key] -= 1
+			self._condition.notify()
+
+	# Lends a connection for the duration of a with block; release() rolls back whatever was not committed
+	@contextlib.contextmanager
+	def lease(self, dsn, database=None):
+		connection = self.acquire(dsn, database)
+		try:
+			yield connection
+		finally:
+			self.release(connection)
+
+	def closeAll(self):
+		with self._condition:
+			for key, connections in self._idle.items():
+				for connection in connections:
+					try:
+						connection.close()
+					except pyodbc.Error:
+						pass
+					del self._keys[id(connection)]
+					self._openCount[key] -= 1
+			self._idle = {}
+
+	def getStats(self):
+		listLog = []
+		with self._condition:
+			for (dsn, database), stats in self._stats.items():
+				log = "(" + str(datetime.today()) + f")  Connection pool [{dsn}.{database}]:  {stats['opened']} opened, {stats['acquired']} acquired, {stats['replaced']} replaced, "
+				log += f"wait {stats['waitSeconds']:.3f}s total / {stats['maxWaitSeconds']:.3f}s max\n"
+				listLog.append(log)
+		return listLog
+
+# END OF FILE
@@ -0,0 +1,213 @@
+#   FILE HEADER
+#       File Name:  DiffEngine.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the in-process change detection used by the Schedule and TimeEvent
+#       loaders.  It replaces the round trip of copying prod rows into [stage.*] on ETLServer, calling
+#       import.usp_DoStaging* to flag New/Update/Delete, and reading the stage table back.  Instead the
+#       imported API rows and the prod snapshot are indexed by their key column in Python and compared
+#       directly, and only the changes are pushed to ProdServer.
+#
+#   TECHNICAL Notes
+#       - Rows are any indexable sequence (pyodbc Row, tuple) with identical column order on both sides
+#       - Rows rejected by dropRow (struck records, incomplete time events) are treated as absent from
+#         the API, so their prod copies are flagged for deletion and they are never inserted
+#       - A row is an Update when any compared column differs; the comparison is NULL-safe, unlike the
+#         column-by-column IIF(i.Col = s.Col, ...) tests in the staging procedures
+#       - Duplicate keys in the API rows collapse to the last row, matching the DISTINCT key handling
+#         in the staging procedures
+#       - Rows are compared through a 64-bit digest of their canonicalized compared columns, so an
+#         unchanged row costs a single integer comparison
+#       - The digests of the rows in prod after a successful push are kept in a local sidecar index
+#         (<Entity>_digests.json).  When every prod key in the refresh window is found in the sidecar,
+#         the loader only reads the keys from ProdServer instead of every column
+#       - The sidecar is written under <Entity>_digests.lock, an OS file lock (msvcrt on Windows, fcntl
+#         elsewhere), so a QGendaBackfill.py run overlapping the nightly QGendaMain.py run cannot lose an
+#         update made by the other process.  Threads of one process are serialized by _digestIndexLock
+#         first, as the file lock is held per process
+#       - payloadDigest() digests a whole source payload independently of record order.  The dimension
+#         loaders keep the digest of their last successful load in the <Entity>_payload RunState and
+#         skip the refresh when the new payload has the same digest, unless skipUnchangedPayloads is
+#         turned off (replay runs, which must reload the archived payload whatever was loaded last)
+
+import hashlib
+import contextlib
+import json
+import os
+import RunState
+import threading
+import uuid
+if os.name == "nt":
+	import msvcrt
+else:
+	import fcntl
+from datetime import date, datetime, time
+from decimal import Decimal
+
+digestPath = os.path.join("C:\\", "Users", "Public", "ANES ETL", "QGenda Data Mart", "state", "")
+skipUnchangedPayloads = True
+_digestIndexLock = threading.Lock()		# Backfill partitions of one entity update its sidecar concurrently
+
+# Renders a column value the same way regardless of which server or driver produced it
+def _canonical(value):
+	if value is None:
+		return "\x00"
+	if isinstance(value, uuid.UUID):
+		return "s" + str(value).upper()
+	if isinstance(value, str):
+		# GUIDs compare case-insensitively
+		if len(value) == 36 and value.count("-") == 4:
+			return "s" + value.upper()
+		return "s" + value
+	if isinstance(value, bool):
+		return "b1" if value else "b0"
+	if isinstance(value, (int, Decimal, float)):
+		return "n" + str(Decimal(str(value)).normalize())
+	if isinstance(value, (datetime, date, time)):
+		return "d" + value.isoformat()
+	return "o" + str(value)
+
+# Stable 64-bit digest over the columns at the given positions
+def rowDigest(row, indexes):
+	text = "\x1f".join(_canonical(row[i]) for i in indexes)
+	return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+# Maps key -> digest for a list of rows
+def digestRows(rows, keyIndex, indexes):
+	return {row[keyIndex]: rowDigest(row, indexes) for row in rows}
+
+# Digests the pending result set of cursor in fetchmany() batches, so the full rows are never held at once
+def digestCursor(cursor, keyIndex, indexes, batchSize=5000):
+	digests = {}
+	while True:
+		rows = cursor.fetchmany(batchSize)
+		if not rows:
+			break
+		digests.update(digestRows(rows, keyIndex, indexes))
+	return digests
+
+# Translates column names into positions within a row
+def columnIndexes(columns, names):
+	return [columns.index(name) for name in names]
+
+# prodDigests maps each prod key to its digest; a digest of None forces the row to be treated as an Update
+def computeChanges(apiRows, prodDigests, keyIndex, compareIndexes, dropRow=None):
+	apiIndex = {}
+	for row in apiRows:
+		if dropRow is not None and dropRow(row):
+			continue
+		apiIndex[row[keyIndex]] = row
+
+	changes = {"New": [], "Update": [], "Delete": [], "Digests": {}}
+	for key, row in apiIndex.items():
+		digest = rowDigest(row, compareIndexes)
+		changes["Digests"][key] = digest
+
+		if key not in prodDigests:
+			changes["New"].append(row)
+		elif prodDigests[key] != digest:
+			changes["Update"].append(row)
+
+	for key in prodDigests:
+		if key not in apiIndex:
+			changes["Delete"].append(key)
+
+	return changes
+
+# Names of the columns whose values differ between two versions of a row, compared like the digest
+def changedColumns(newRow, oldRow, columns):
+	return [column for i, column in enumerate(columns) if _canonical(newRow[i]) != _canonical(oldRow[i])]
+
+# Maps key -> changed column names for every row whose previous version is in prodRows ({key: row})
+def getChangedColumns(rows, prodRows, keyIndex, columns):
+	return {row[keyIndex]: changedColumns(row, prodRows[row[keyIndex]], columns) for row in rows if row[keyIndex] in prodRows}
+
+# Rows that must be written to prod: new records and the new version of updated records
+def getInsertRows(changes):
+	return changes["New"] + changes["Update"]
+
+# Returns {str(key): digest} from the sidecar index, or None when there is no usable index
+def loadDigestIndex(entityName):
+	try:
+		with open(digestPath + entityName + "_digests.json", "r", encoding="utf-8") as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+# Holds the sidecar index of entityName against other threads and processes
+@contextlib.contextmanager
+def _lockDigestIndex(entityName):
+	os.makedirs(digestPath, exist_ok=True)
+	with _digestIndexLock:
+		with open(digestPath + entityName + "_digests.lock", "a+b") as lockFile:
+			lockFile.seek(0)
+			if os.name == "nt":
+				while True:
+					try:
+						msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+						break
+					except OSError:
+						pass		# LK_LOCK gives up after 10 seconds; keep waiting for the other process
+			else:
+				fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				lockFile.seek(0)
+				if os.name == "nt":
+					msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+				else:
+					fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+
+# Written as a .tmp file and renamed, so readers never see a partial index; the caller holds the lock
+def _writeDigestIndex(entityName, digests):
+	fileName = digestPath + entityName + "_digests.json"
+	with open(fileName + ".tmp", "w", encoding="utf-8") as file:
+		json.dump({str(key): digest for key, digest in digests.items()}, file)
+	os.replace(fileName + ".tmp", fileName)
+
+# Replaces the sidecar index with the digests of the rows now in prod
+def saveDigestIndex(entityName, digests):
+	with _lockDigestIndex(entityName):
+		_writeDigestIndex(entityName, digests)
+
+# Digests of the prod window after the push: unchanged and updated rows keep/replace theirs, deleted rows drop out
+def getPushedDigests(prodDigests, changes):
+	deletedKeys = set(changes["Delete"])
+	digests = {key: digest for key, digest in prodDigests.items() if key not in deletedKeys}
+	digests.update(changes["Digests"])
+	return digests
+
+# Applies a partial (incremental) change set to the sidecar index instead of replacing it
+def updateDigestIndex(entityName, changes):
+	with _lockDigestIndex(entityName):
+		digestIndex = loadDigestIndex(entityName) or {}
+		for key in changes["Delete"]:
+			digestIndex.pop(str(key), None)
+		digestIndex.update({str(key): digest for key, digest in changes["Digests"].items()})
+		_writeDigestIndex(entityName, digestIndex)
+
+# Text of one source record: a dictionary (API) or a row sequence (ODBC)
+def _recordText(record):
+	if isinstance(record, dict):
+		return json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+	return "\x1f".join(_canonical(value) for value in record)
+
+# 128-bit digest of a payload; the records are digested one by one and sorted, so their order does not matter
+def payloadDigest(records):
+	recordDigests = sorted(hashlib.blake2b(_recordText(record).encode("utf-8"), digest_size=16).digest() for record in records)
+	return hashlib.blake2b(b"".join(recordDigests), digest_size=16).hexdigest()
+
+# True when digest matches the payload of the last successful load of entityName
+def isPayloadUnchanged(entityName, digest):
+	if not skipUnchangedPayloads:
+		return False
+	return RunState.load(entityName + "_payload").get("digest") == digest
+
+# Records digest as the payload of a successful load of entityName
+def savePayloadDigest(entityName, digest):
+	RunState.save(entityName + "_payload", {"digest": digest, "loaded": RunState.fromDatetime(datetime.today())})
+
+# END OF FILE
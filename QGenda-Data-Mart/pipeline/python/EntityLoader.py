@@ -0,0 +1,616 @@
+#   FILE HEADER
+#       File Name:  EntityLoader.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the loader shared by every QGenda Data Mart table.  Each loader used
+#       to repeat the same BLOCKs (acquire, fetch, archive, import, compare, push, clean up) with a
+#       different column list, so every fix had to be made seven times and the copies drifted apart.
+#       The loader modules now only declare their entity as a spec and call refreshDimension():
+#
+#           {"name": "Task", "label": "TASK", "functionName": "Task.getTask()",
+#            "source": "shared", "endPointURL": getEndPointURL, "readRecords": ..., "archiveName": "Task",
+#            "importTable": "import.qdm_Task", "clearTables": [], "importSchema": ...,
+#            "prodTable": "dim.Task", "keyColumn": "TaskKey", "columns": [...],
+#            "compare": "staged", "stageTable": "stage.qdm_Task", "stageFlag": "NULL AS ETLCommand",
+#            "stagingProcedure": "import.usp_DoStagingTask", "requireProdRows": True, "push": "replace"}
+#
+#   TECHNICAL Notes
+#       - source is where the import table is loaded from:
+#           - "shared": one endpoint downloaded once per run (client.getShared); readRecords(response)
+#             returns the API records to import and digest.  The raw payload is archived under its
+#             endpoint URL by client.getShared(), named archiveName, so loaders sharing the endpoint
+#             give the same name.  clearTables are truncated together with importTable
+#           - "window": the date window passed as window (see below), requested as one or more date
+#             ranges, maxRequestWorkers at a time with up to maxRequestAttempts attempts each.  Every range
+#             is decoded from its response (streamed when stream is True), archived and inserted on its
+#             own; a range that fails, or has a rejected record, is removed from the import again by its
+#             windowColumn and left unchanged in prod
+#           - "edw": sourceQuery run on the sourceDsn connection (Tag is read from EDW, not the API)
+#       - compare is how changes are found and pushed:
+#           - "staged": the prod table is streamed into stageTable (columns plus the stageFlag column)
+#             and stagingProcedure flags the changes.  push "replace" deletes the prod records flagged
+#             Update and inserts those flagged New/Update; push "upsert" applies the rows flagged
+#             PushToProductionFlag = 'T', updating only their changed columns.  requireProdRows fails the
+#             refresh when the prod table is empty (a lost dimension is not rebuilt by accident)
+#           - "digest": the import is compared with the prod rows of the window in Python (DiffEngine.py)
+#             over compareColumns; rows matching dropRow(row) are treated as absent from the source.  The
+#             changes are applied in one transaction (BulkWriter.upsertRows).  onPushed(window, rowsImport,
+#             processStart, listLog) is called once every row reached prod (TimeEvent's watermark)
+#       - refreshMode "swap" replaces a "staged" dimension whose import table holds its full snapshot in
+#         prod column order (shadowSwap True: Tag, Task) through its shadow table: the import is streamed
+#         straight into <prodTable>_Shadow and switched in, without staging the prod rows or calling the
+#         staging procedure (BulkWriter.refreshByShadowSwap).  Prod records missing from the snapshot are
+#         carried over, as the staging procedures never delete
+#       - window is {"companyKey", "startDate", "endDate", "isFullWindow", "modifiedSince", "isolated",
+#         "requests": [(rangeStart, rangeEnd, endPointURL)]}.  modifiedSince makes the run incremental: only
+#         the prod versions of the imported records are compared and nothing is deleted.  isFullWindow
+#         False (hot window, backfill partition) updates the digest sidecar instead of replacing it, and
+#         isolated=True imports into a session temp table copied from importTable (see Backfill.py)
+#       - The "shared" and "edw" sources skip the refresh when the payload is unchanged since the last
+#         successful load (DiffEngine.isPayloadUnchanged)
+#       - A "window" refresh with a failed range is reported as failed after the loaded ranges are pushed
+#       - The elapsed time of every ETL phase is logged at the end of the refresh
+
+import ApiDecoder
+import Archive
+import BulkWriter
+import DiffEngine
+import JsonStream
+import concurrent.futures
+import contextlib
+import pyodbc
+from datetime import datetime
+
+logSpacer = "                           " #27 spaces for logging
+
+def _log(listLog, message):
+	log = "(" + str(datetime.today()) + ")  " + message + "\n"
+	print(log)
+	listLog.append(log)
+
+def _phase(listLog, phases, name):
+	phases.append((name, datetime.today()))
+	log = "\n\nETL PHASE: " + name + "\n\n"
+	print(log)
+	listLog.append(log)
+
+# Names the phase a refresh failed in, before the clean-up phase starts (read by Checkpoint.py)
+def _failedPhase(listLog, phases):
+	log = "ETL PHASE FAILED: " + phases[-1][0] + "\n"
+	print(log)
+	listLog.append(log)
+
+def _extend(listLog, entries):
+	for log in entries:
+		print(log)
+		listLog.append(log)
+
+# Loads the shared endpoint into the import table; returns (status, payload digest), status None to continue
+def _importShared(client, cursorETL, spec, listLog):
+	importTableName = spec["importTable"]
+	endPointURL = spec["endPointURL"]()
+	_log(listLog, "Requesting data from QGenda API.")
+
+	response = client.getShared(endPointURL, spec["archiveName"])
+	records = spec["readRecords"](response)
+
+	_log(listLog, f"Received {spec['label']} data from QGenda API")
+
+	# An identical payload was already loaded by the last successful run; nothing can have changed
+	payloadDigest = DiffEngine.payloadDigest(records)
+	if DiffEngine.isPayloadUnchanged(spec["name"], payloadDigest):
+		_log(listLog, f"{spec['label']} payload unchanged since the last successful load, refresh skipped")
+		return 200, payloadDigest
+
+	for tableName in spec["clearTables"] + [importTableName]:
+		_log(listLog, f"Submitting TRUNCATE command.  Target table: [ETLServer.StagingQGenda.{tableName}]")
+		cursorETL.execute("TRUNCATE TABLE " + tableName + ";")
+		cursorETL.commit()
+
+	_log(listLog, f"Inserting records.  Target table: [ETLServer.StagingQGenda.{importTableName}]")
+	rowsInserted, rowsDecoded, insertLog = ApiDecoder.insertRecords(cursorETL, importTableName, spec["importSchema"], records)
+	_extend(listLog, insertLog)
+
+	# A record missing from the import would be treated as deleted, so rejected records stop the refresh
+	if rowsInserted != rowsDecoded:
+		_log(listLog, f"ERROR: {str(rowsDecoded - rowsInserted)} of {str(rowsDecoded)} {spec['label']} records rejected by [{importTableName}], no changes pushed")
+		return 400, payloadDigest
+
+	_log(listLog, f"Data successfully transferred to ETLServer:  {str(rowsInserted)} records.")
+	return None, payloadDigest
+
+# Loads the result of the EDW query into the import table; returns (status, payload digest), status None to continue
+def _importEdw(cursorSource, cursorETL, spec, listLog):
+	importTableName = spec["importTable"]
+
+	_log(listLog, f"Getting data from EDW.  Target table: [{spec['sourceTable']}]")
+	cursorSource.execute(spec["sourceQuery"])
+	rowsSource = cursorSource.fetchall()
+
+	if not rowsSource:
+		_log(listLog, "QUERY ERROR:  No records pulled from EDW.")
+		return 400, None
+
+	_log(listLog, f"{str(len(rowsSource))} records pulled from EDW.")
+
+	# An identical payload was already loaded by the last successful run; nothing can have changed
+	payloadDigest = DiffEngine.payloadDigest(rowsSource)
+	if DiffEngine.isPayloadUnchanged(spec["name"], payloadDigest):
+		_log(listLog, f"{spec['label']} payload unchanged since the last successful load, refresh skipped")
+		return 200, payloadDigest
+
+	_log(listLog, f"Submitting TRUNCATE command.  Target table: [ETLServer.StagingQGenda.{importTableName}]")
+	cursorETL.execute("TRUNCATE TABLE " + importTableName + ";")
+	cursorETL.commit()
+
+	_log(listLog, f"Inserting records.  Target table: [ETLServer.StagingQGenda.{importTableName}]")
+	sql = "INSERT INTO " + importTableName + " VALUES (" + ", ".join("?" * len(rowsSource[0])) + ")"
+	rowsInserted, insertLog = BulkWriter.insertRows(cursorETL, sql, rowsSource, importTableName)
+	_extend(listLog, insertLog)
+
+	if rowsInserted != len(rowsSource):
+		_log(listLog, f"ERROR: {str(len(rowsSource) - rowsInserted)} of {str(len(rowsSource))} {spec['label']} records rejected by [{importTableName}], no changes pushed")
+		return 400, payloadDigest
+
+	_log(listLog, f"Data successfully transferred to ETLServer:  {str(rowsInserted)} records.")
+	return None, payloadDigest
+
+# Requests the ranges of the window and loads each into loadTableName as it arrives; returns (loaded ranges, failed ranges)
+def _importWindow(client, cursorETL, spec, window, loadTableName, listLog):
+	requests = window["requests"]
+	importTableName = spec["importTable"]
+	windowColumn = spec["windowColumn"]
+
+	_log(listLog, f"Submitting TRUNCATE command.  Target table: [ETLServer.StagingQGenda.{loadTableName}]")
+	cursorETL.execute("TRUNCATE TABLE " + loadTableName + ";")
+	cursorETL.commit()
+
+	# A single request covering the full window is archived without a date; ranges are told apart by their start
+	def archivePart(rangeStart):
+		return None if window["isFullWindow"] and len(requests) == 1 else rangeStart
+
+	loadedRanges = []
+	failedRanges = []
+	with concurrent.futures.ThreadPoolExecutor(max_workers=spec["maxRequestWorkers"]) as executor:
+		futures = {executor.submit(client.getWithRetry, endPointURL, spec["maxRequestAttempts"], stream=spec["stream"]): (rangeStart, rangeEnd, endPointURL) for rangeStart, rangeEnd, endPointURL in requests}
+
+		# Ranges are loaded on this thread in the order they arrive; the ODBC cursor is not shared
+		for future in concurrent.futures.as_completed(futures):
+			rangeStart, rangeEnd, endPointURL = futures[future]
+			try:
+				response = future.result()
+				if response.status_code != 200:
+					raise RuntimeError(f"status {response.status_code}")
+
+				# The range is archived (compressed, on a background thread) as it is decoded; a streamed
+				# body is inserted while it downloads
+				with Archive.open(spec["archiveName"], archivePart(rangeStart), endPointURL) as file:
+					records = JsonStream.iterRecords(JsonStream.teeText(JsonStream.iterText(response), file))
+					rowsInserted, rowsDecoded, insertLog = ApiDecoder.insertRecords(cursorETL, loadTableName, spec["importSchema"], records, catalogTableName=importTableName)
+
+				_extend(listLog, insertLog)
+				if rowsInserted != rowsDecoded:
+					raise RuntimeError(f"{str(rowsDecoded - rowsInserted)} of {str(rowsDecoded)} records rejected")
+			except Exception as error:
+				# Batches of a failed range may already be committed; they are removed so the range is skipped as a whole
+				if isinstance(error, pyodbc.Error):
+					cursorETL.rollback()
+				cursorETL.execute("DELETE FROM " + loadTableName + " WHERE " + windowColumn + " BETWEEN ? AND ?;", rangeStart, rangeEnd)
+				cursorETL.commit()
+				failedRanges.append((rangeStart, rangeEnd))
+				_log(listLog, f"{spec['label']} range {str(rangeStart)} to {str(rangeEnd)} failed, its dates are left unchanged: {error!r}")
+			else:
+				loadedRanges.append((rangeStart, rangeEnd))
+				_log(listLog, f"Received and inserted {spec['label']} range {str(rangeStart)} to {str(rangeEnd)} ({str(rowsInserted)} records).  Target table: [ETLServer.StagingQGenda.{loadTableName}]")
+
+	loadedRanges.sort()
+	return loadedRanges, failedRanges
+
+# Streams the prod dimension into the stage table; returns rows copied
+def _stageProdRows(cursorCore, cursorETL, spec, listLog):
+	stageTableName = spec["stageTable"]
+	prodTableName = spec["prodTable"]
+
+	_log(listLog, f"Preparing ETLServer for records.  Submitting TRUNCATE command.  Target table: [{stageTableName}]")
+	cursorETL.execute("TRUNCATE TABLE " + stageTableName + ";")
+	cursorETL.commit()
+
+	_log(listLog, f"Retrieving records from ProdServer.  Target table: [{prodTableName}]")
+	cursorCore.execute("""
+		SELECT
+			""" + "\n\t\t\t, ".join(spec["columns"] + [spec["stageFlag"]]) + """
+		FROM """ + prodTableName + """;
+	""")
+
+	_log(listLog, f"Streaming records retrieved from ProdServer.  Target table: [{stageTableName}]")
+	sql = "INSERT INTO " + stageTableName + " VALUES (" + ", ".join("?" * (len(spec["columns"]) + 1)) + ");"
+	rowsReturned, rowsInserted, copyLog = BulkWriter.copyRows(cursorCore, cursorETL, sql, stageTableName)
+	_extend(listLog, copyLog)
+	return rowsReturned
+
+# Deletes the prod records flagged Update and inserts the records flagged New or Update in one transaction; returns True when pushed
+def _pushReplace(cursorCore, cursorETL, spec, listLog):
+	stageTableName = spec["stageTable"]
+	prodTableName = spec["prodTable"]
+
+	_log(listLog, f"Identifying records flagged for update only.  Deletion not part of current ETL process.  Target: [ProdServer.QGenda.{stageTableName}]")
+	cursorETL.execute("""
+		SELECT
+			ETLCommand
+			, """ + "\n\t\t\t, ".join(spec["columns"]) + """
+		FROM """ + stageTableName + """
+		WHERE ETLCommand IN ('New', 'Update');
+	""")
+	deleteKeys, insertRows = BulkWriter.readStagedChanges(cursorETL, keyIndex=spec["columns"].index(spec["keyColumn"]))
+
+	if not insertRows:
+		_log(listLog, "No new or updated records identified, no transfer required")
+		return True
+
+	# Note: Only deletion that takes place is for records that have a staged replacement.  Both are applied
+	# in one transaction, so a replacement that cannot be written never leaves its record deleted
+	_log(listLog, f"Deleting {str(len(deleteKeys))} records flagged for update and inserting {str(len(insertRows))} records flagged as new or updated.  Target: [ProdServer.QGenda.{prodTableName}]")
+	rowsDeleted, rowsInserted, rowsRejected, replaceLog = BulkWriter.replaceRows(cursorCore, prodTableName, spec["columns"], spec["keyColumn"], insertRows, deleteKeys)
+	_extend(listLog, replaceLog)
+
+	if rowsRejected:
+		_log(listLog, f"ERROR: {str(rowsRejected)} staged {spec['label']} records rejected by [{prodTableName}], no changes pushed")
+		return False
+
+	_log(listLog, f"Staged {spec['label']} records successfully written to ProdServer:  {str(rowsDeleted)} deleted, {str(rowsInserted)} inserted")
+	return True
+
+# Applies the records flagged PushToProductionFlag = 'T' in one transaction; returns True when pushed
+def _pushUpsert(cursorCore, cursorETL, spec, listLog):
+	stageTableName = spec["stageTable"]
+	prodTableName = spec["prodTable"]
+	columns = spec["columns"]
+
+	_log(listLog, f"Selecting records flagged for transfer.  Target: [ETLServer.StagingQGenda.{stageTableName}]")
+	cursorETL.execute("""
+		SELECT DISTINCT
+			""" + "\n\t\t\t, ".join(columns) + """
+		FROM """ + stageTableName + """
+		WHERE PushToProductionFlag = 'T'""" + (("\n\t\tORDER BY " + spec["pushOrderBy"]) if spec.get("pushOrderBy") else "") + """;
+	""")
+	rowsETL = cursorETL.fetchall()
+
+	if not rowsETL:
+		_log(listLog, f"No changes to {spec['label']} records detected.")
+		return True
+
+	_log(listLog, f"Applying {str(len(rowsETL))} staged records in one transaction.  Target: [ProdServer.QGenda.{prodTableName}]")
+
+	# Existing records only have their changed columns updated
+	keyIndex = columns.index(spec["keyColumn"])
+	prodRows = BulkWriter.readRowsByKey(cursorCore, prodTableName, columns, spec["keyColumn"], [row[keyIndex] for row in rowsETL])
+	changedColumns = DiffEngine.getChangedColumns(rowsETL, prodRows, keyIndex, columns)
+
+	rowsDeleted, rowsUpdated, rowsInserted, rowsRejected, upsertLog = BulkWriter.upsertRows(cursorCore, prodTableName, columns, spec["keyColumn"], rowsETL, [], changedColumns)
+	_extend(listLog, upsertLog)
+
+	# The rejected records were left out; failing keeps the payload digest unsaved, so the next run retries them
+	if rowsRejected:
+		_log(listLog, f"ERROR: {str(rowsRejected)} of {str(len(rowsETL))} staged {spec['label']} records rejected by [{prodTableName}]")
+		return False
+
+	_log(listLog, f"Staged {spec['label']} records successfully transferred:  {str(rowsInserted)} inserted, {str(rowsUpdated)} updated")
+	return True
+
+# Replaces the prod dimension with the imported snapshot through its shadow table; returns the status code
+def _refreshSwap(cursorCore, cursorETL, spec, listLog, phases):
+	prodTableName = spec["prodTable"]
+
+	# BLOCKS 03-05 | Push the snapshot to production
+	#
+	#	- The import table already holds the full snapshot, so it is streamed straight into the shadow
+	#		table; the prod rows are not staged and the staging procedure is not called
+	#	- Prod records missing from the snapshot are carried over, and the row count check of
+	#		BulkWriter.refreshByShadowSwap() keeps a short snapshot out of prod
+
+	_phase(listLog, phases, "Pushing snapshot to ProdServer")
+
+	_log(listLog, f"Replacing the dimension through its shadow table.  Target: [ProdServer.QGenda.{prodTableName}]")
+	swapped, swapLog = BulkWriter.refreshByShadowSwap(cursorETL, cursorCore, spec["importTable"], prodTableName, keyColumn=spec["keyColumn"], requireLiveRows=spec["requireProdRows"])
+	_extend(listLog, swapLog)
+	return 200 if swapped else 400
+
+# Stages the prod rows, flags the changes with the staging procedure and pushes them; returns the status code
+def _refreshStaged(cursorCore, cursorETL, spec, listLog, phases):
+	prodTableName = spec["prodTable"]
+
+	# BLOCK 03 | Retrieving data from ProdServer
+	#
+	#	- The stage table is truncated and the prod records are streamed into it
+
+	_phase(listLog, phases, "Data retrieval from ProdServer")
+
+	rowsReturned = _stageProdRows(cursorCore, cursorETL, spec, listLog)
+
+	if rowsReturned > 0:
+		_log(listLog, f"Retrieved {str(rowsReturned)} records from ProdServer")
+	elif spec["requireProdRows"]:
+		_log(listLog, f"ERROR: No records found in [{prodTableName}]")
+		return 400
+	else:
+		_log(listLog, f"No records found in [{prodTableName}]")
+
+
+	# BLOCK 04 | Consolidate and stage records
+	#
+	#	- The entity's staging procedure compares the import with the staged prod records and flags
+	#		new and updated records
+
+	_phase(listLog, phases, "Staging records on ETLServer")
+
+	_log(listLog, f"Staging {spec['label']} data by calling [{spec['stagingProcedure']}]")
+	cursorETL.execute("{CALL " + spec["stagingProcedure"] + "}")
+	# USPs are defined in \QGenda-Data-Mart\pipeline\sql
+	cursorETL.commit()
+	_log(listLog, "Staging complete")
+
+
+	# BLOCK 05 | Push staged records to production
+	#
+	#	- The flagged records are pushed
+
+	_phase(listLog, phases, "Pushing staged records to ProdServer")
+
+	if spec["push"] == "upsert":
+		if not _pushUpsert(cursorCore, cursorETL, spec, listLog):
+			return 400
+	elif not _pushReplace(cursorCore, cursorETL, spec, listLog):
+		return 400
+	return 200
+
+# Compares the import with the prod rows of the loaded ranges in Python and applies the changes; returns the status code
+def _refreshDigest(cursorCore, cursorETL, spec, window, loadTableName, loadedRanges, failedRanges, processStart, listLog, phases):
+	prodTableName = spec["prodTable"]
+	columns = spec["columns"]
+	keyColumn = spec["keyColumn"]
+	modifiedSince = window.get("modifiedSince")
+
+	# BLOCK 03 | Retrieving data for change detection
+	#
+	#	- The freshly imported records are read back from the import table
+	#	- Keys of the prod records that fall into the loaded ranges are retrieved; full records are only
+	#		read when the local digest index does not cover every key.  An incremental run only reads the
+	#		prod versions of the imported records
+	#	- No copy of the prod records is written to a stage table; see DiffEngine.py
+
+	_phase(listLog, phases, "Data retrieval for change detection")
+
+	_log(listLog, f"Retrieving imported records.  Target: [ETLServer.StagingQGenda.{loadTableName}]")
+	cursorETL.execute("""
+		SELECT
+			""" + "\n\t\t\t, ".join(columns) + """
+		FROM """ + loadTableName + """;
+	""")
+	rowsImport = cursorETL.fetchall()
+	_log(listLog, f"Retrieved {str(len(rowsImport))} imported records")
+
+	_log(listLog, f"Retrieving records within refresh window from ProdServer.  Target: [{prodTableName}]")
+
+	keyIndex = columns.index(keyColumn)
+	compareIndexes = DiffEngine.columnIndexes(columns, spec["compareColumns"])
+	windowFilter = "WHERE " + " OR ".join(spec["windowColumn"] + " BETWEEN '" + str(rangeStart) + "' AND '" + str(rangeEnd) + "'" for rangeStart, rangeEnd in loadedRanges)
+
+	if modifiedSince is not None:
+		# Only the imported (modified) records are compared, so only their prod versions are read
+		prodRows = BulkWriter.readRowsByKey(cursorCore, prodTableName, columns, keyColumn, [row[keyIndex] for row in rowsImport])
+		prodDigests = DiffEngine.digestRows(prodRows.values(), keyIndex, compareIndexes)
+		_log(listLog, f"Retrieved {str(len(prodDigests))} matching records from ProdServer")
+	else:
+		cursorCore.execute("SELECT " + keyColumn + " FROM " + prodTableName + " " + windowFilter + ";")
+		prodKeys = [row[0] for row in cursorCore.fetchall()]
+
+		digestIndex = DiffEngine.loadDigestIndex(spec["name"])
+		if digestIndex is not None and all(str(key) in digestIndex for key in prodKeys):
+			# Every prod row in the window was written by a previous run; its digest is known locally
+			prodDigests = {key: digestIndex[str(key)] for key in prodKeys}
+			_log(listLog, f"Retrieved {str(len(prodKeys))} keys from ProdServer, digests read from sidecar index")
+		else:
+			cursorCore.execute("""
+				SELECT
+					""" + "\n\t\t\t\t\t, ".join(columns) + """
+				FROM """ + prodTableName + """
+				""" + windowFilter + """;
+			""")
+			prodDigests = DiffEngine.digestCursor(cursorCore, keyIndex, compareIndexes)
+			_log(listLog, f"Retrieved {str(len(prodDigests))} records from ProdServer, sidecar index missing or incomplete")
+
+
+	# BLOCK 04 | Change detection
+	#
+	#	- Imported and prod records are indexed by the key column and compared in memory
+	#		1) Records matching dropRow (struck, incomplete) are removed from the import and deleted from prod
+	#		2) Records missing from the import are flagged for deletion (not in an incremental run, whose
+	#			import only holds modified records)
+	#		3) Records not yet in prod are flagged as New
+	#		4) Records whose digest over the compared columns changed are flagged for Update
+
+	_phase(listLog, phases, "Change detection")
+
+	changes = DiffEngine.computeChanges(rowsImport, prodDigests, keyIndex, compareIndexes, dropRow=spec.get("dropRow"))
+
+	listLog.append(f"{logSpacer})  Found {str(len(changes['New']))} records flagged as New\n")
+	listLog.append(f"{logSpacer})  Found {str(len(changes['Update']))} records flagged for Update\n")
+	listLog.append(f"{logSpacer})  Found {str(len(changes['Delete']))} records flagged for Deletion\n")
+	_log(listLog, "Change detection complete.")
+
+
+	# BLOCK 05 | Push changes to production
+	#
+	#	- Loads the change set into temp tables on ProdServer and applies it in a single transaction:
+	#		deleted records are removed, updated records have only their changed columns updated and new
+	#		records are inserted
+
+	_phase(listLog, phases, "Pushing changes to ProdServer")
+
+	deleteKeys = changes["Delete"]
+	upsertRows = DiffEngine.getInsertRows(changes)
+
+	if len(deleteKeys) + len(upsertRows) > 0:
+		_log(listLog, f"Applying {str(len(upsertRows))} new or updated and {str(len(deleteKeys))} deleted records in one transaction.  Target: [ProdServer.QGenda.{prodTableName}]")
+
+		# Read the current version of the updated records so only their changed columns are written
+		prodRows = BulkWriter.readRowsByKey(cursorCore, prodTableName, columns, keyColumn, [row[keyIndex] for row in changes["Update"]])
+		changedColumns = DiffEngine.getChangedColumns(changes["Update"], prodRows, keyIndex, columns)
+
+		rowsDeleted, rowsUpdated, rowsInserted, rowsRejected, upsertLog = BulkWriter.upsertRows(cursorCore, prodTableName, columns, keyColumn, upsertRows, deleteKeys, changedColumns)
+		_extend(listLog, upsertLog)
+
+		_log(listLog, f"{spec['label']} changes successfully written to ProdServer:  {str(rowsInserted)} inserted, {str(rowsUpdated)} updated, {str(rowsDeleted)} deleted")
+	else:
+		rowsRejected = 0
+		_log(listLog, "No new, updated or deleted records identified, no transfer required")
+
+	# The sidecar is only rewritten when every row reached prod, so rejected rows are compared again next run.
+	# An incremental, hot window or partial run updates the index instead of replacing it
+	if rowsRejected == 0:
+		if modifiedSince is None and window["isFullWindow"] and not failedRanges:
+			DiffEngine.saveDigestIndex(spec["name"], DiffEngine.getPushedDigests(prodDigests, changes))
+		else:
+			DiffEngine.updateDigestIndex(spec["name"], changes)
+		if spec.get("onPushed") is not None:
+			spec["onPushed"](window, rowsImport, processStart, listLog)
+	else:
+		_log(listLog, f"{str(rowsRejected)} records rejected, sidecar digest index and run state not updated")
+
+	# A partial refresh is reported as a failure so the failed ranges are noticed
+	return 400 if failedRanges else 200
+
+# BLOCKs 02-05 on leased connections; returns the status of the refresh
+def _refresh(client, Source, ETL, Core, spec, refreshMode, window, processStart, listLog, phases):
+	importTableName = spec["importTable"]
+	isolated = window is not None and window.get("isolated", False)
+
+	cursorETL = ETL.cursor()
+	if isolated:
+		# A backfill partition loads a session copy of the import table, so partitions run at the same time do not collide
+		loadTableName = "#" + importTableName.split(".")[1]
+		BulkWriter.createTempTable(cursorETL, loadTableName, importTableName)
+	else:
+		loadTableName = importTableName
+
+	try:
+		# BLOCK 02 | Retrieving the source data
+		#
+		#	- Request the endpoint(s), or query EDW, and archive the payload
+		#	- Skip a dimension refresh when the payload is unchanged since the last successful load
+		#	- Truncate (clear) the import table and insert the decoded records
+
+		payloadDigest = None
+		loadedRanges = []
+		failedRanges = []
+
+		if spec["source"] == "window":
+			_phase(listLog, phases, "Data retrieval from QGenda API")
+			if window.get("modifiedSince") is None:
+				_log(listLog, f"Requesting data from QGenda API in {str(len(window['requests']))} ranges from {str(window['startDate'])} to {str(window['endDate'])}.")
+			else:
+				_log(listLog, f"Incremental refresh of records modified since {str(window['modifiedSince'])}.  Requesting data from QGenda API.")
+
+			loadedRanges, failedRanges = _importWindow(client, cursorETL, spec, window, loadTableName, listLog)
+			if not loadedRanges:
+				_log(listLog, f"No {spec['label']} range could be retrieved, no changes pushed")
+				return 400
+			_log(listLog, f"Data successfully transferred to ETLServer for {str(len(loadedRanges))} of {str(len(window['requests']))} ranges.")
+		elif spec["source"] == "edw":
+			_phase(listLog, phases, "Data retrieval from EDW")
+			status, payloadDigest = _importEdw(Source.cursor(), cursorETL, spec, listLog)
+			if status is not None:
+				return status
+		else:
+			_phase(listLog, phases, "Data retrieval from QGenda API")
+			status, payloadDigest = _importShared(client, cursorETL, spec, listLog)
+			if status is not None:
+				return status
+
+
+		# BLOCKS 03-05 | Compare with production and push the changes
+
+		cursorCore = Core.cursor()
+		if spec["compare"] == "digest":
+			status = _refreshDigest(cursorCore, cursorETL, spec, window, loadTableName, loadedRanges, failedRanges, processStart, listLog, phases)
+		elif refreshMode == "swap":
+			status = _refreshSwap(cursorCore, cursorETL, spec, listLog, phases)
+		else:
+			status = _refreshStaged(cursorCore, cursorETL, spec, listLog, phases)
+
+		# The payload digest is only recorded once the load succeeded, so a failed refresh is retried next run
+		if status == 200 and payloadDigest is not None:
+			DiffEngine.savePayloadDigest(spec["name"], payloadDigest)
+
+		return status
+	finally:
+		if isolated:
+			try:
+				BulkWriter.dropTempTable(cursorETL, loadTableName)
+			except pyodbc.Error:
+				pass		# createTempTable drops a leftover copy before the next partition loads it
+
+def refreshDimension(client, pool, spec, refreshMode="stage", window=None):
+	# BLOCK 01 | Initialization
+	#
+	#	- Lease ODBC connections from the shared pool; they are released (and rolled back) even when the
+	#	  refresh raises, so the next loader on this thread starts with a clean connection
+	#	- Requests are made through the shared QGendaClient (already authenticated)
+
+	if refreshMode == "swap" and not spec.get("shadowSwap"):
+		raise ValueError(f"{spec['name']} cannot be refreshed by shadow swap: its import table is not a dimension snapshot")
+
+	processStart = datetime.today()
+	phases = []
+
+	listLog = [spec["functionName"] + " commencing\n", f"Process Start Timestamp: {str(processStart)}\n"]
+	if spec["source"] == "edw":
+		listLog.append("NOTE:  DATA SOURCE IS EDW, NOT QGENDA API\n")
+	_phase(listLog, phases, "Initialization")
+
+	try:
+		with contextlib.ExitStack() as leases:
+			Source = leases.enter_context(pool.lease(spec["sourceDsn"])) if spec["source"] == "edw" else None
+			ETL = leases.enter_context(pool.lease("ETL1", "StagingQGenda"))
+			Core = leases.enter_context(pool.lease("Core", "QGenda"))
+			listLog.append("ODBC connections acquired from pool\n")
+
+			status = _refresh(client, Source, ETL, Core, spec, refreshMode, window, processStart, listLog, phases)
+
+			processEnd = datetime.today()
+
+
+			# BLOCK 06 | Write log and clean up
+			#
+			#	- Release ODBC connections to the shared pool (end of the with block)
+			#	- Log the duration of every phase
+
+			if status != 200:
+				_failedPhase(listLog, phases)
+			_phase(listLog, phases, "Process clean-up")
+	except Exception as error:
+		# Pipeline.runLoaders() logs the partial listLog, so the checkpoint still records the failed phase
+		_failedPhase(listLog, phases)
+		error.listLog = listLog
+		raise
+
+	for (name, phaseStart), (_, phaseEnd) in zip(phases, phases[1:]):
+		listLog.append(f"Phase duration, {name}: {str(phaseEnd - phaseStart)}\n")
+
+	log = f"End process timestamp: {str(processEnd)}\n"
+	print(log)
+	listLog.append(log)
+
+	log = f"Process duration: {str(processEnd - processStart)}\n"
+	print(log)
+	listLog.append(log)
+
+	log = spec["functionName"] + " complete\n\n"
+	print(log)
+	listLog.append(log)
+
+	return status, listLog
+
+# END OF FILE
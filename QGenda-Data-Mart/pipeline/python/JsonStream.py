@@ -0,0 +1,84 @@
+#   FILE HEADER
+#       File Name:  JsonStream.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the incremental reading of the JSON arrays returned by the QGenda REST
+#       API.  A payload is no longer held as one Python string and parsed in a single call; records are
+#       decoded as the response body is read and handed on in bounded batches (see ApiDecoder.py).
+#
+#   TECHNICAL Notes
+#       - Only the standard library json decoder is used (JSONDecoder.raw_decode on a sliding buffer)
+#       - The payload must be a JSON array of objects, which every QGenda endpoint used here returns
+#       - A body that ends before the closing ] raises ValueError, so a truncated download is never
+#         mistaken for a complete one (the loaders delete prod records missing from the import)
+#       - iterText() works on streamed (stream=True) and already downloaded (prefetched, shared) responses
+
+import json
+
+whitespace = " \t\r\n\ufeff"		# \ufeff: byte order mark
+
+# Decoded text of a response body, chunk by chunk
+def iterText(response, chunkSize=65536):
+	if response.encoding is None:
+		response.encoding = "utf-8"
+	for text in response.iter_content(chunk_size=chunkSize, decode_unicode=True):
+		if text:
+			yield text
+
+# Passes text chunks through unchanged while writing them to file
+def teeText(textChunks, file):
+	for text in textChunks:
+		file.write(text)
+		yield text
+
+# Yields each object of a JSON array as soon as its closing brace has been read
+def iterRecords(textChunks):
+	decoder = json.JSONDecoder()
+	buffer = ""
+	position = 0
+	isOpen = False
+
+	for text in textChunks:
+		buffer = buffer[position:] + text
+		position = 0
+
+		while True:
+			while position < len(buffer) and (buffer[position] in whitespace or (isOpen and buffer[position] == ",")):
+				position += 1
+			if position == len(buffer):
+				break
+
+			if not isOpen:
+				if buffer[position] != "[":
+					raise ValueError("QGenda API payload is not a JSON array")
+				isOpen = True
+				position += 1
+				continue
+
+			if buffer[position] == "]":
+				return
+			if buffer[position] != "{":
+				raise ValueError(f"Unexpected character {buffer[position]!r} in QGenda API payload")
+
+			try:
+				record, position = decoder.raw_decode(buffer, position)
+			except json.JSONDecodeError:
+				break		# The object continues in the next chunk
+			yield record
+
+	raise ValueError("QGenda API payload ended before the end of the JSON array")
+
+# Groups records into lists of at most batchSize
+def batched(records, batchSize):
+	batch = []
+	for record in records:
+		batch.append(record)
+		if len(batch) == batchSize:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+# END OF FILE
@@ -0,0 +1,82 @@
+#   FILE HEADER
+#       File Name:  Pipeline.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines a dependency-aware runner for the QGenda Data Mart loaders.  Each
+#       loader is declared together with the loaders it depends on.  Any loader whose dependencies have
+#       completed successfully is submitted to a bounded thread pool, so loaders that do not depend on
+#       each other wait on the QGenda API and the ODBC connections at the same time.
+#
+#   TECHNICAL Notes
+#       - Loaders are declared as dictionaries:
+#           {"name": "Schedule", "target": "[dbo.Schedule]", "function": Schedule.getSchedule,
+#            "args": (...), "dependsOn": []}
+#       - Every loader function returns a Tuple [int, list] (status code, listLog)
+#       - Threads are used instead of processes because the loaders are I/O bound; pyodbc and requests
+#         release the GIL while waiting on the network
+#       - Results are returned in declaration order, not completion order, so the main log is stable
+#       - A loader is skipped (never started) when any loader it depends on did not return 200
+#       - A loader that raises is given status 500; its log is the listLog attached to the exception (see
+#         EntityLoader.refreshDimension), if any, followed by the traceback
+#       - onComplete(loader, status, listLog) is called on the calling thread as soon as each loader
+#         finishes or is skipped (status None), e.g. to checkpoint the run (see Checkpoint.py)
+
+import concurrent.futures
+import traceback
+from datetime import datetime
+
+def runLoaders(loaders, maxWorkers=4, onComplete=None):
+	names = [loader["name"] for loader in loaders]
+	for loader in loaders:
+		for dependency in loader.get("dependsOn", []):
+			if dependency not in names:
+				raise ValueError(f"Loader {loader['name']} depends on undeclared loader {dependency}")
+
+	results = {}		# name -> (status, listLog)
+	pending = list(loaders)
+	running = {}		# future -> loader
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+		while pending or running:
+			# Submit every loader whose dependencies are finished; skip those with a failed dependency
+			for loader in list(pending):
+				dependencies = loader.get("dependsOn", [])
+				if not all(dependency in results for dependency in dependencies):
+					continue
+
+				pending.remove(loader)
+				failed = [dependency for dependency in dependencies if results[dependency][0] != 200]
+				if failed:
+					log = "(" + str(datetime.today()) + f")  Skipped, dependency did not complete: {', '.join(failed)}\n"
+					print(log)
+					results[loader["name"]] = (None, [log])
+					if onComplete is not None:
+						onComplete(loader, *results[loader["name"]])
+					continue
+
+				log = "(" + str(datetime.today()) + f")  Starting loader {loader['name']}\n"
+				print(log)
+				future = executor.submit(loader["function"], *loader.get("args", ()))
+				running[future] = loader
+
+			if not running:
+				# Every remaining loader was skipped during this pass
+				continue
+
+			done, notDone = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				loader = running.pop(future)
+				try:
+					results[loader["name"]] = future.result()
+				except (Exception, SystemExit) as error:
+					log = "(" + str(datetime.today()) + f")  Loader {loader['name']} raised an exception\n" + traceback.format_exc()
+					print(log)
+					results[loader["name"]] = (500, list(getattr(error, "listLog", [])) + [log])
+				if onComplete is not None:
+					onComplete(loader, *results[loader["name"]])
+
+	return [(loader, results[loader["name"]][0], results[loader["name"]][1]) for loader in loaders]
+
+# END OF FILE
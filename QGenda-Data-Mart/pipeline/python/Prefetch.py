@@ -0,0 +1,54 @@
+#   FILE HEADER
+#       File Name:  Prefetch.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the prefetch stage run at the start of QGendaMain.py.  The QGenda
+#       endpoints used by the loaders do not depend on each other, so they are all requested at once
+#       and the responses are buffered in the shared QGendaClient.  Each loader then receives its
+#       buffered payload from client.get() when it reaches BLOCK 02 instead of waiting on the network.
+#
+#   TECHNICAL Notes
+#       - Requests are scheduled with asyncio; the blocking requests.Session calls run on worker threads
+#         through asyncio.to_thread, so no additional HTTP library is required
+#       - maxConcurrency caps the number of requests in flight at the same time
+#       - A failed or non-200 prefetch is logged and not buffered; the loader then requests the endpoint
+#         itself and handles the failure as before
+
+import asyncio
+from datetime import datetime
+
+async def _fetch(client, endPointURL, semaphore):
+	async with semaphore:
+		return await asyncio.to_thread(client.get, endPointURL, False)
+
+async def _fetchAll(client, endPointURLs, maxConcurrency):
+	semaphore = asyncio.Semaphore(maxConcurrency)
+	tasks = [_fetch(client, endPointURL, semaphore) for endPointURL in endPointURLs]
+	return await asyncio.gather(*tasks, return_exceptions=True)
+
+def prefetchEndpoints(client, endPointURLs, maxConcurrency=4):
+	listLog = []
+
+	log = "(" + str(datetime.today()) + f")  Prefetching {len(endPointURLs)} QGenda API endpoints, up to {maxConcurrency} at a time\n"
+	print(log)
+	listLog.append(log)
+
+	results = asyncio.run(_fetchAll(client, endPointURLs, maxConcurrency))
+
+	for endPointURL, result in zip(endPointURLs, results):
+		endpoint = endPointURL.split("?")[0]
+		if isinstance(result, Exception):
+			log = "(" + str(datetime.today()) + f")  Prefetch failed for {endpoint}: {result!r}.  Loader will request it directly.\n"
+		elif result.status_code != 200:
+			log = "(" + str(datetime.today()) + f")  Prefetch returned status {result.status_code} for {endpoint}.  Loader will request it directly.\n"
+		else:
+			client.buffer(endPointURL, result)
+			log = "(" + str(datetime.today()) + f")  Prefetched {endpoint}\n"
+		print(log)
+		listLog.append(log)
+
+	return listLog
+
+# END OF FILE
@@ -0,0 +1,130 @@
+#   FILE HEADER
+#       File Name:  QGendaBackfill.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script reloads the history of a date-windowed table over an arbitrary date range,
+#       e.g. a year of Schedule after a QGenda configuration change, outside of the nightly run:
+#
+#           python QGendaBackfill.py Schedule --start 2024-01-01 --end 2024-12-31
+#
+#       The range is split into month partitions loaded concurrently (see Backfill.py).  A backfill that
+#       failed part way is resumed by running the same command again.
+#
+#   TECHNICAL Notes
+#       - All scripts need to be kept within the same directory
+#       - Supported entities are Schedule and TimeEvent
+#       - Partitions import into session temp tables, so a backfill does not use import.qdm_Schedule or
+#         import.qdm_TimeEvent and does not interfere with the refresh windows or the TimeEvent watermark
+#         of the nightly QGendaMain.py run
+#       - --restart discards the checkpoint of an earlier attempt over the same range
+#       - A backfill does not start while the QGendaRun checkpoint (Checkpoint.py) shows a QGendaMain.py
+#         run in progress: both would push the same dates to prod.  A run that was killed leaves its
+#         checkpoint "running" until it is resumed with QGendaMain.py --resume
+
+# Import QGenda Data Mart scripts
+import Schedule
+import TimeEvent
+import Backfill
+import Checkpoint
+import ConnectionPool
+import QGendaClient
+import Archive
+
+# Python Packages
+import argparse
+import os
+import sys
+from datetime import date, datetime
+
+parser = argparse.ArgumentParser(description="Reloads the history of a QGenda Data Mart table in month partitions")
+parser.add_argument("entity", choices=["Schedule", "TimeEvent"])
+parser.add_argument("--start", required=True, type=date.fromisoformat, help="first date to reload (YYYY-MM-DD)")
+parser.add_argument("--end", required=True, type=date.fromisoformat, help="last date to reload (YYYY-MM-DD)")
+parser.add_argument("--workers", type=int, default=4, help="month partitions loaded at the same time (default 4)")
+parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an earlier attempt over the same range")
+arguments = parser.parse_args()
+if arguments.end < arguments.start:
+    parser.error("--end is before --start")
+runState = Checkpoint.load()
+if runState.get("status") == "running":
+    parser.error(f"the QGendaMain.py run started {runState.get('runStart')} has not finished; wait for it, or resume it if it was killed")
+
+print("QGenda Data Mart backfill commencing.")
+
+# BEGIN SCRIPT #
+# BLOCK 01 | Initialization
+	#   - Configure proxy
+	#	- Authenticate the shared QGenda API client
+
+proxySite = "scrubbed"
+os.environ["HTTP_PROXY"] = proxySite
+os.environ["HTTPS_PROXY"] = proxySite
+
+logPath = os.path.join("C:\\", "Users", "Public", "ANES ETL", "QGenda Data Mart", "logs", "")
+logName = "QGendaBackfillLog_" + str(date.today()) + ".txt"
+
+processStart = datetime.today()
+mainLog = ["QGenda Data Mart Backfill Log\n","-----------------------------\n", f"Process Start Timestamp: {str(processStart)}\n\n"]
+
+log = "(" + str(datetime.today()) + ")  Authenticating with QGenda API\n"
+print(log)
+mainLog.append(log)
+
+companyKey = "scrubbed"
+
+client = QGendaClient.QGendaClient()
+client.login(email="", password="")      # Don't forget to add credentials
+
+log = "(" + str(datetime.today()) + ")  Authentication successful\n\n"
+print(log)
+mainLog.append(log)
+
+# Backfill archives are kept like any run's, but they cannot be replayed by QGendaMain.py --replay
+Archive.setParameters({"backfill": {"entity": arguments.entity, "startDate": arguments.start.isoformat(), "endDate": arguments.end.isoformat()}})
+
+
+# BLOCK 02 | Load the month partitions
+	#   - Each partition runs the entity's loader over its own month, isolated in a session temp table
+	#   - Completed partitions are checkpointed; a rerun of the same command skips them
+
+# Each partition borrows one ETL and one Core connection
+pool = ConnectionPool.ConnectionPool(maxConnectionsPerKey=arguments.workers)
+
+if arguments.entity == "Schedule":
+    def loadPartition(partitionStart, partitionEnd):
+        return Schedule.getSchedule(client, companyKey, partitionStart, partitionEnd, pool, isFullWindow=False, isolated=True)
+else:
+    def loadPartition(partitionStart, partitionEnd):
+        return TimeEvent.getTimeEvent(client, companyKey, partitionStart, partitionEnd, pool, None, isFullWindow=False, isolated=True)
+
+status, listLog = Backfill.runBackfill(arguments.entity, loadPartition, arguments.start, arguments.end, arguments.workers, arguments.restart)
+for entry in listLog:
+    mainLog.append(entry)
+
+for log in pool.getStats():
+    print(log)
+    mainLog.append(log)
+pool.closeAll()
+
+for log in client.getTimings():
+    print(log)
+    mainLog.append(log)
+client.close()
+
+for log in Archive.close():
+    print(log)
+    mainLog.append(log)
+
+processEnd = datetime.today()
+processDuration = processEnd - processStart
+
+with open(logPath + logName, 'a') as logFile:
+    logFile.writelines(mainLog)
+    logFile.write(f"End process timestamp: {str(processEnd)}\n")
+    logFile.write(f"Process duration: {str(processDuration)}\n")
+    logFile.write("\n---- QGENDA DATA MART BACKFILL COMPLETE ----\n\n")
+
+sys.exit(0 if status == 200 else 1)
+#  END OF FILE
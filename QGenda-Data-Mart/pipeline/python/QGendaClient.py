@@ -0,0 +1,168 @@
+#   FILE HEADER
+#       File Name:  QGendaClient.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the client used for every call to the QGenda REST API.  QGendaMain.py
+#       builds a single client, authenticates it and passes it to each loader.  The client keeps one
+#       requests.Session for the whole run, so TCP and TLS connections through the proxy are reused
+#       instead of being re-established for every endpoint.
+#
+#	QGenda REST API (https://restapi.qgenda.com/)
+#
+#   TECHNICAL Notes
+#       - Proxy settings are read from the HTTP_PROXY/HTTPS_PROXY environment variables set in QGendaMain.py
+#       - Responses are negotiated with gzip/deflate content encoding
+#       - Each request is timed; getTimings() returns log entries for the main log.  A streamed request
+#         (stream=True) is timed to its response headers and logs the Content-Length, as its body is read
+#         later by the loader (see JsonStream.py)
+#       - The client is shared between loader threads; the connection pool is sized for that
+#       - Responses downloaded ahead of time (see Prefetch.py) are buffered per endpoint and handed out
+#         once by get(); a loader whose endpoint was not prefetched requests it as usual.  A streamed get()
+#         never receives a buffered response (its body is already in memory); the buffered copy is dropped
+#       - getShared() coalesces requests for an endpoint used by more than one loader (/staffmember and
+#         /task with includes=Tags): the first caller downloads it, later and concurrent callers wait for
+#         and reuse the same response for the rest of the run.  The first caller also archives the raw
+#         payload under its endpoint URL (Archive.py), so it is replayable whichever loader fetched it
+#       - projectRecords() applies a $select/$orderby projection client-side to a shared payload
+#       - getWithRetry() retries a request that failed on the network or returned a transient status
+#         (429/5xx) with an exponential back-off; the last response or error is returned/raised
+
+import Archive
+import json
+import requests
+import threading
+import time
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+retryStatusCodes = (429, 500, 502, 503, 504)
+
+class QGendaClient:
+	def __init__(self, rootURL="https://api.qgenda.com/v2", poolSize=10, timeout=(30, 600)):
+		self.rootURL = rootURL
+		self.timeout = timeout		# (connect, read) seconds
+		self.token = None
+
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+		self.session.mount("https://", adapter)
+		self.session.mount("http://", adapter)
+		self.session.headers.update({
+			'Accept-Encoding': 'gzip, deflate',
+			'Connection': 'keep-alive'
+		})
+
+		self._timingLock = threading.Lock()
+		self._timings = []		# (method, endpoint, status code, seconds, bytes)
+
+		self._bufferLock = threading.Lock()
+		self._buffer = {}		# endPointURL -> prefetched response
+		self._shared = {}		# endPointURL -> [threading.Event, response or exception]
+
+	def _request(self, method, endPointURL, **kwargs):
+		requestStart = time.perf_counter()
+		response = self.session.request(method, self.rootURL + endPointURL, timeout=self.timeout, **kwargs)
+		seconds = time.perf_counter() - requestStart
+
+		endpoint = endPointURL.split("?")[0]
+		size = int(response.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(response.content)
+		with self._timingLock:
+			self._timings.append((method, endpoint, response.status_code, seconds, size))
+
+		return response
+
+	def login(self, email, password):
+		headers = {
+			'Content-Type': 'application/x-www-form-urlencoded'
+		}
+		payload = {'email': email, 'password': password}
+
+		response = self._request("POST", "/login", headers=headers, data=payload)
+		responseDictionary = response.json()
+		self.token = responseDictionary['access_token']
+		self.session.headers.update({'Authorization': f'bearer {self.token}'})
+
+		return response
+
+	def get(self, endPointURL, useBuffer=True, stream=False):
+		if useBuffer or stream:
+			with self._bufferLock:
+				response = self._buffer.pop(endPointURL, None)
+			if response is not None and not stream:
+				return response
+		return self._request("GET", endPointURL, stream=stream)
+
+	def getWithRetry(self, endPointURL, attempts=3, backoff=2.0, stream=False):
+		for attempt in range(1, attempts + 1):
+			try:
+				response = self.get(endPointURL, useBuffer=(attempt == 1), stream=stream)
+			except requests.RequestException:
+				if attempt == attempts:
+					raise
+			else:
+				if response.status_code not in retryStatusCodes or attempt == attempts:
+					return response
+				response.close()
+			time.sleep(backoff ** attempt)
+
+	def getShared(self, endPointURL, archiveName):
+		with self._bufferLock:
+			entry = self._shared.get(endPointURL)
+			isOwner = entry is None
+			if isOwner:
+				entry = [threading.Event(), None]
+				self._shared[endPointURL] = entry
+
+		if isOwner:
+			try:
+				entry[1] = self.get(endPointURL)
+				if entry[1].status_code == 200:
+					with Archive.open(archiveName, endPointURL=endPointURL) as file:
+						file.write(entry[1].content)
+			except Exception as error:
+				entry[1] = error
+			entry[0].set()
+		else:
+			entry[0].wait()
+
+		if isinstance(entry[1], Exception):
+			raise entry[1]
+		return entry[1]
+
+	def buffer(self, endPointURL, response):
+		with self._bufferLock:
+			self._buffer[endPointURL] = response
+
+	def close(self):
+		with self._bufferLock:
+			self._buffer = {}
+			self._shared = {}
+		self.session.close()
+
+	def getTimings(self):
+		listLog = []
+		with self._timingLock:
+			for method, endpoint, statusCode, seconds, size in self._timings:
+				log = "(" + str(datetime.today()) + f")  API {method} {endpoint}:  status {statusCode}, {seconds:.3f}s, {size} bytes\n"
+				listLog.append(log)
+		return listLog
+
+# Applies a $select (and optional $orderby) to a JSON array payload on the client side; returns the records
+def projectRecords(responseText, columns, orderBy=None):
+	records = json.loads(responseText)
+	projected = [{column: record.get(column) for column in columns} for record in records]
+
+	if orderBy:
+		def sortKey(record):
+			values = []
+			for column in orderBy:
+				value = record.get(column)
+				values.append((value is None, value.casefold() if isinstance(value, str) else value))
+			return values
+		projected.sort(key=sortKey)
+
+	return projected
+
+# END OF FILE
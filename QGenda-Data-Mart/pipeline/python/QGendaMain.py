@@ -17,6 +17,13 @@
 #       - All scripts need to be kept within the same directory
 #       - Each imported script defines a single function responsible for transferring
 #         a specific set of records (Schedule, StaffMember,etc)
+#       - Loaders are run by Pipeline.runLoaders(); independent loaders run concurrently and
+#         TagStaff/TagTask wait for StaffMember/Task to complete.  TagTask also waits for TagStaff:
+#         both load the single import.TagsAPI working table
+#       - QGendaMain.py --replay <run> reloads the tables from the payloads archived by an earlier run
+#         instead of the QGenda API (see Replay.py); --entities limits the run to some of the loaders
+#       - Each loader's outcome is checkpointed as it finishes (see Checkpoint.py); QGendaMain.py --resume
+#         only runs the loaders that did not complete in the last run
 
 # Import QGenda Data Mart scripts
 import Schedule
@@ -26,12 +33,21 @@ import Task
 import TagTask
 import StaffMember
 import TagStaff
+import Pipeline
+import ConnectionPool
+import QGendaClient
+import Prefetch
+import Archive
+import RefreshWindow
+import Replay
+import DiffEngine
+import Checkpoint
 
 # Python Packages
+import argparse
 import os
-import requests
 import sys
-from datetime import date, datetime, timedelta
+from datetime import date, datetime
 
 # LOCAL METHODS
 def WriteLogToFile(log):
@@ -49,17 +65,28 @@ def WriteLogToFile(log):
             logFile.write(f"Process duration: {str(processDuration)}\n")
             logFile.write("\n---- QGENDA DATA MART REFRESH COMPLETE ----")
 
+parser = argparse.ArgumentParser(description="Refreshes the QGenda Data Mart from the QGenda REST API")
+parser.add_argument("--replay", metavar="RUN", help="reload from the payloads archived by RUN (run timestamp, date or 'latest') instead of the API")
+parser.add_argument("--entities", nargs="+", metavar="NAME", help="only run these loaders (replay default: every loader that reads the API)")
+parser.add_argument("--resume", action="store_true", help="only run the loaders that did not complete in the last run")
+arguments = parser.parse_args()
+isReplay = arguments.replay is not None
+if isReplay and arguments.resume:
+    parser.error("--resume cannot be combined with --replay")
+
+# Loader names, in the order they are declared in BLOCK 03
+loaderNames = ["Schedule", "TimeEvent", "StaffMember", "Tag", "Task", "TagStaff", "TagTask"]
+unknownEntities = set(arguments.entities or []) - set(loaderNames)
+if unknownEntities:
+    parser.error("unknown entities: " + ", ".join(sorted(unknownEntities)))
+
 print("QGenda Data Mart update commencing.")
 
 # BEGIN SCRIPT #
 # BLOCK 01 | Initialization
 	#   - Configure proxy
 	#	- Configuration for connecting to QGenda REST API
-	#	- Request and store access token
-
-proxySite = "scrubbed"
-os.environ["HTTP_PROXY"] = proxySite
-os.environ["HTTPS_PROXY"] = proxySite
+	#	- Authenticate the shared QGenda API client, or open the archived run to replay
 
 logPath = os.path.join("C:\\", "Users", "Public", "ANES ETL", "QGenda Data Mart", "logs", "")
 logName = "QGendaPipelineLog_" + str(date.today()) + ".txt"
@@ -67,187 +94,224 @@ logName = "QGendaPipelineLog_" + str(date.today()) + ".txt"
 processStart = datetime.today()
 mainLog = ["QGenda Data Mart Refresh Log\n","----------------------------\n", f"Process Start Timestamp: {str(processStart)}\n\n"]
             
-log = "(" + str(datetime.today()) + ")  Authenticating with QGenda API\n"
-print(log)
-mainLog.append(log)
-
-companyKey = "scrubbed"
-url = "https://api.qgenda.com/v2/login"
-headers = {
-	'Content-Type': 'application/x-www-form-urlencoded'
-}
-payload='email=&password='      # Don't forget to add credentials
-
-response = requests.request("POST", url, headers=headers, data=payload)
-responseDictionary = response.json()
-accessToken = responseDictionary['access_token']
-
-log = "(" + str(datetime.today()) + ")  Authentication successful\n\n"
-print(log)
-mainLog.append(log)
-
-log = "(" + str(datetime.today()) + ")  Determining date range for data refresh\n"
-print(log)
-mainLog.append(log)
-
-#Refresh window set to 30 days prior to today through 60 days ahead of today
-currentDate = date.today()
-endDate = currentDate + timedelta(days=60)
-startDate = currentDate - timedelta(days=30)
-
-log = "(" + str(datetime.today()) + f")  Refresh window set from {str(startDate)} to {str(endDate)}.\n\n"
-print(log)
-mainLog.append(log)
-
-
-log = "(" + str(datetime.today()) + ")  Refreshing [dbo.Schedule]\n"
-print(log)
-mainLog.append(log)
-
-#result is a Tuple [int, list]
-result = Schedule.getSchedule(accessToken, companyKey, startDate, endDate)
-
-for entry in result[1]:
-    mainLog.append(entry)
-
-if result[0] == 200:   
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
+if isReplay:
+    # The replay client serves the archived payloads; nothing is archived again and every loader reloads
+    manifest = Replay.loadManifest(arguments.replay)
+    replayParameters = manifest["parameters"]
+    if "backfill" in replayParameters:
+        parser.error(f"run {manifest['runStamp']} is a QGendaBackfill.py run and cannot be replayed")
+    client = Replay.ReplayClient(manifest)
+    companyKey = replayParameters["companyKey"]
+    Archive.enabled = False
+    DiffEngine.skipUnchangedPayloads = False
+
+    log = "(" + str(datetime.today()) + f")  Replaying archived run {manifest['runStamp']} ({len(manifest['files'])} payloads), QGenda API not used\n\n"
     print(log)
     mainLog.append(log)
 else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
+    proxySite = "scrubbed"
+    os.environ["HTTP_PROXY"] = proxySite
+    os.environ["HTTPS_PROXY"] = proxySite
+
+    log = "(" + str(datetime.today()) + ")  Authenticating with QGenda API\n"
     print(log)
     mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
-
-
-log = "(" + str(datetime.today()) + ")  Refreshing [dbo.TimeEvent]\n"
-print(log)
-mainLog.append(log)
 
-#result is a Tuple [int, list]
-result = TimeEvent.getTimeEvent(accessToken, companyKey, startDate, endDate)
+    companyKey = "scrubbed"
 
-for entry in result[1]:
-    mainLog.append(entry)
+    # One API client for the whole run; its session keeps connections through the proxy alive
+    client = QGendaClient.QGendaClient()
+    client.login(email="", password="")      # Don't forget to add credentials
 
-if result[0] == 200:
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
-    print(log)
-    mainLog.append(log)
-else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
+    log = "(" + str(datetime.today()) + ")  Authentication successful\n\n"
     print(log)
     mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
 
+# Tag is read from EDW, not the QGenda API, so there is nothing of it to replay
+entities = arguments.entities or [name for name in loaderNames if not (isReplay and name == "Tag")]
+
+# Replays are not checkpointed, so --resume always refers to the last live run
+checkpoint = None
+if not isReplay:
+    previousRun = Checkpoint.load() if arguments.resume else None
+    if previousRun:
+        completedEntities = Checkpoint.getCompleted(previousRun)
+        entities = [name for name in entities if name not in completedEntities]
+
+        log = "(" + str(datetime.today()) + f")  Resuming run of {previousRun.get('runStart')} ({previousRun.get('status')}), completed loaders skipped: {', '.join(completedEntities) or 'none'}\n"
+        print(log)
+        mainLog.append(log)
+        for name, loader in previousRun.get("loaders", {}).items():
+            if loader.get("status") != 200:
+                log = "(" + str(datetime.today()) + f")  {name} did not complete" + (f", failed in phase {loader['failedPhase']}" if loader.get("failedPhase") else "") + ", restarting it\n"
+                print(log)
+                mainLog.append(log)
+        mainLog.append("\n")
+    elif arguments.resume:
+        log = "(" + str(datetime.today()) + ")  No checkpoint of an earlier run found, running every loader\n\n"
+        print(log)
+        mainLog.append(log)
+    checkpoint = Checkpoint.start(processStart, previousRun)
 
-log = "(" + str(datetime.today()) + ")  Refreshing [dim.StaffMember]\n"
+log = "(" + str(datetime.today()) + ")  Determining date range for data refresh\n"
 print(log)
 mainLog.append(log)
 
-#result is a Tuple [int, list]
-result = StaffMember.getStaffMember(accessToken)
+#Full refresh window is 30 days prior to today through 60 days ahead of today.  Schedule refreshes the
+#hot window (7 days either side of today) every run and the full window once a week; TimeEvent always
+#covers the full window because its LastModifiedDate watermark already limits it to changed records
+refreshPolicies = {
+    "Schedule":  {"pastDays": 30, "futureDays": 60, "hotPastDays": 7, "hotFutureDays": 7, "coldIntervalDays": 7},
+    "TimeEvent": {"pastDays": 30, "futureDays": 60},
+}
 
-for entry in result[1]:
-    mainLog.append(entry)
+refreshWindows = {}
+for entityName, policy in refreshPolicies.items():
+    if isReplay:
+        # A replay requests the same windows as the archived run, so every URL is found in its manifest
+        refreshWindows[entityName] = (Replay.toDate(replayParameters[entityName]["startDate"]), Replay.toDate(replayParameters[entityName]["endDate"]), replayParameters[entityName]["isFullWindow"])
+    else:
+        refreshWindows[entityName] = RefreshWindow.getWindow(entityName, policy, now=processStart)
+    startDate, endDate, isFullWindow = refreshWindows[entityName]
 
-if result[0] == 200:
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
-    print(log)
-    mainLog.append(log)
-else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
+    log = "(" + str(datetime.today()) + f")  {entityName} refresh window set from {str(startDate)} to {str(endDate)} ({'full' if isFullWindow else 'hot'} window).\n"
     print(log)
     mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
-
-
-log = "(" + str(datetime.today()) + ")  Refreshing [dim.Tag]\n"
-print(log)
-mainLog.append(log)
-
-# result is a Tuple [int, list]
-result = Tag.getTags(accessToken, companyKey)
+mainLog.append("\n")
 
-for entry in result[1]:
-    mainLog.append(entry)
+scheduleStartDate, scheduleEndDate, scheduleFullWindow = refreshWindows["Schedule"]
+timeEventStartDate, timeEventEndDate, _ = refreshWindows["TimeEvent"]
 
-if result[0] == 200:
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
-    print(log)
-    mainLog.append(log)
+scheduleChunkDays = 7     # The Schedule window is requested in chunks of this many days
+if isReplay:
+    scheduleChunkDays = replayParameters["scheduleChunkDays"]
+    timeEventModifiedSince = Replay.toDatetime(replayParameters["timeEventModifiedSince"])
 else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
-    print(log)
-    mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
-
-# Task
-log = "(" + str(datetime.today()) + ")  Refreshing [dim.Task]\n"
+    timeEventModifiedSince = TimeEvent.getModifiedSince(companyKey, processStart)
+
+    # Kept in the archive manifest so the run can be replayed with the same requests
+    runParameters = {"companyKey": companyKey, "scheduleChunkDays": scheduleChunkDays, "timeEventModifiedSince": timeEventModifiedSince.isoformat() if timeEventModifiedSince else None}
+    for entityName, (startDate, endDate, isFullWindow) in refreshWindows.items():
+        runParameters[entityName] = {"startDate": startDate.isoformat(), "endDate": endDate.isoformat(), "isFullWindow": isFullWindow}
+    Archive.setParameters(runParameters)
+
+
+# BLOCK 02 | Prefetch QGenda API endpoints
+	#   - Every endpoint used by the loaders is requested concurrently and buffered in the client
+	#   - Loaders receive the buffered payload instead of issuing their own request
+	#   - Skipped when replaying, the archived payloads are read by the loaders themselves
+	#   - Only the endpoints of the loaders that run are requested (--entities, --resume)
+	#   - TimeEvent is not prefetched: its response is streamed into the import as it downloads, which a
+	#     buffered response would defeat
+
+maxPrefetchConcurrency = 6
+
+if not isReplay:
+    endPointURLs = []
+    if "Schedule" in entities:
+        endPointURLs += Schedule.getEndPointURLs(companyKey, scheduleStartDate, scheduleEndDate, scheduleChunkDays)
+    if "StaffMember" in entities or "TagStaff" in entities:
+        endPointURLs.append(StaffMember.getEndPointURL())       # Shared with TagStaff
+    if "Task" in entities or "TagTask" in entities:
+        endPointURLs.append(Task.getEndPointURL())              # Shared with TagTask
+
+    for log in Prefetch.prefetchEndpoints(client, endPointURLs, maxPrefetchConcurrency):
+        mainLog.append(log)
+    mainLog.append("\n")
+
+
+# BLOCK 03 | Refresh QGenda Data Mart tables
+	#   - Loaders are declared with their dependencies and run by Pipeline.runLoaders()
+	#   - Loaders without a dependency between them run at the same time in a bounded thread pool
+	#   - TagTask waits for TagStaff because both load the single import.TagsAPI working table
+	#   - Each loader's log is merged into the main log in the order declared below
+	#   - --entities, --resume and replays run a subset; dependencies on loaders left out are dropped
+	#     (a resumed loader's dependencies completed in the run it resumes)
+	#   - Every loader's outcome is checkpointed as soon as it finishes
+
+maxLoaderWorkers = 5      # Every loader without a dependency starts immediately
+
+# "stage" reconciles Tag/Task row by row; "swap" bulk loads each imported snapshot into its dim.*_Shadow
+# table and switches it in (the shadow tables must be deployed first).  TagStaff/TagTask are always staged:
+# their rows only exist once the staging procedure has pivoted the tags
+dimensionRefreshMode = "stage"
+
+# One pool for the whole run; each concurrent loader borrows at most one connection per DSN
+pool = ConnectionPool.ConnectionPool(maxConnectionsPerKey=maxLoaderWorkers)
+
+loaders = [
+    {"name": "Schedule",    "target": "[dbo.Schedule]",     "function": Schedule.getSchedule,       "args": (client, companyKey, scheduleStartDate, scheduleEndDate, pool, scheduleChunkDays, scheduleFullWindow), "dependsOn": []},
+    {"name": "TimeEvent",   "target": "[dbo.TimeEvent]",    "function": TimeEvent.getTimeEvent,     "args": (client, companyKey, timeEventStartDate, timeEventEndDate, pool, timeEventModifiedSince), "dependsOn": []},
+    {"name": "StaffMember", "target": "[dim.StaffMember]",  "function": StaffMember.getStaffMember, "args": (client, pool),                                  "dependsOn": []},
+    {"name": "Tag",         "target": "[dim.Tag]",          "function": Tag.getTags,                "args": (client, companyKey, pool, dimensionRefreshMode), "dependsOn": []},
+    {"name": "Task",        "target": "[dim.Task]",         "function": Task.getTask,               "args": (client, pool, dimensionRefreshMode),            "dependsOn": []},
+    {"name": "TagStaff",    "target": "[dim.TaggedStaff]",  "function": TagStaff.getStaffTags,      "args": (client, pool),                                  "dependsOn": ["StaffMember"]},
+    {"name": "TagTask",     "target": "[dim.TaggedTask]",   "function": TagTask.getTaskTags,        "args": (client, pool),                                  "dependsOn": ["Task", "TagStaff"]},
+]
+
+loaders = [loader for loader in loaders if loader["name"] in entities]
+for loader in loaders:
+    loader["dependsOn"] = [dependency for dependency in loader["dependsOn"] if dependency in entities]
+
+def checkpointLoader(loader, status, listLog):
+    if checkpoint is not None:
+        Checkpoint.recordLoader(checkpoint, loader["name"], status, listLog)
+
+log = "(" + str(datetime.today()) + f")  Refreshing {len(loaders)} tables with up to {maxLoaderWorkers} concurrent loaders\n\n"
 print(log)
 mainLog.append(log)
 
-# result is a Tuple [int, list]
-result = Task.getTask(accessToken)
-
-for entry in result[1]:
-    mainLog.append(entry)
+results = Pipeline.runLoaders(loaders, maxLoaderWorkers, checkpointLoader)
 
-if result[0] == 200:
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
-    print(log)
+refreshFailed = False
+for loader, status, listLog in results:
+    log = "(" + str(datetime.today()) + f")  Refreshing {loader['target']}\n"
     mainLog.append(log)
-else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
+
+    for entry in listLog:
+        mainLog.append(entry)
+
+    if isReplay:
+        # Prod now holds the archived (older) data, so the next live run refreshes the full window again
+        if loader["name"] == "TimeEvent":
+            TimeEvent.requireFullSync(companyKey)
+        elif loader["name"] in refreshWindows:
+            RefreshWindow.requireFullRefresh(loader["name"])
+
+    if status == 200:
+        # The cold segments are due again coldIntervalDays after the last successful full window refresh
+        if not isReplay and loader["name"] in refreshWindows and refreshWindows[loader["name"]][2]:
+            RefreshWindow.markRefreshed(loader["name"], processStart)
+        log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
+    else:
+        log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
+        refreshFailed = True
     print(log)
     mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
-
-# Staff Tags
-log = "(" + str(datetime.today()) + ")  Refreshing [dim.TaggedStaff]\n"
-print(log)
-mainLog.append(log)
 
-result = TagStaff.getStaffTags(accessToken)
-
-if result[0] == 200:
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
+for log in pool.getStats():
     print(log)
     mainLog.append(log)
-else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
+pool.closeAll()
+
+for log in client.getTimings():
     print(log)
     mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
-
-# Task Tags
-log = "(" + str(datetime.today()) + ")  Refreshing [dim.TaggedTask]\n"
-print(log)
-mainLog.append(log)
+client.close()
 
-result = TagTask.getTaskTags(accessToken)
+# Loaders archive their payloads on a background thread; wait for it, then apply the retention period
+archiveRetentionDays = 90
 
-if result[0] == 200:
-    log = "(" + str(datetime.today()) + ")  Data refresh successful\n\n"
+for log in Archive.close() + Archive.prune(archiveRetentionDays):
     print(log)
     mainLog.append(log)
-else:
-    log = "(" + str(datetime.today()) + ")  Data refresh failure\n\n"
-    print(log)
-    mainLog.append(log)
-    WriteLogToFile(mainLog)
-    sys.exit()
 
 processEnd = datetime.today()
 processDuration = processEnd - processStart
 
+if checkpoint is not None:
+    Checkpoint.finish(checkpoint, refreshFailed)
+
 WriteLogToFile(mainLog)
-sys.exit()
+sys.exit(1 if refreshFailed else 0)
 #  END OF FILE
\ No newline at end of file
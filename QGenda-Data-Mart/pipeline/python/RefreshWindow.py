@@ -0,0 +1,55 @@
+#   FILE HEADER
+#       File Name:  RefreshWindow.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the refresh window policy of the date-windowed loaders (Schedule,
+#       TimeEvent).  Most changes happen within a few days of today, so each run only refreshes a hot
+#       window around today; the full window, including the cold far past and far future, is refreshed
+#       on a slower cadence.  The policy is declared per entity in QGendaMain.py:
+#
+#           {"pastDays": 30, "futureDays": 60, "hotPastDays": 7, "hotFutureDays": 7, "coldIntervalDays": 7}
+#
+#   TECHNICAL Notes
+#       - A policy without hotPastDays/hotFutureDays always refreshes the full window
+#       - The time of the last successful full window refresh is kept per entity in the "RefreshWindow"
+#         RunState; a missing or damaged state forces a full window refresh
+#       - markRefreshed() is only called by QGendaMain.py after the loader returned 200, so a failed
+#         full refresh is attempted again on the next run
+#       - requireFullRefresh() forgets the last full refresh, e.g. after a replay (see Replay.py)
+
+import RunState
+from datetime import date, datetime, timedelta
+
+# Returns (startDate, endDate, isFullWindow) for this run of entityName
+def getWindow(entityName, policy, today=None, now=None):
+	today = today or date.today()
+	now = now or datetime.today()
+
+	startDate = today - timedelta(days=policy["pastDays"])
+	endDate = today + timedelta(days=policy["futureDays"])
+	if policy.get("hotPastDays") is None or policy.get("hotFutureDays") is None:
+		return startDate, endDate, True
+
+	lastFullRefresh = RunState.toDatetime(RunState.load("RefreshWindow").get(entityName, {}).get("lastFullRefresh"))
+	if lastFullRefresh is None or now - lastFullRefresh >= timedelta(days=policy["coldIntervalDays"]):
+		return startDate, endDate, True
+
+	hotStartDate = max(startDate, today - timedelta(days=policy["hotPastDays"]))
+	hotEndDate = min(endDate, today + timedelta(days=policy["hotFutureDays"]))
+	return hotStartDate, hotEndDate, False
+
+# Records a successful full window refresh of entityName
+def markRefreshed(entityName, now=None):
+	state = RunState.load("RefreshWindow")
+	state.setdefault(entityName, {})["lastFullRefresh"] = RunState.fromDatetime(now or datetime.today())
+	RunState.save("RefreshWindow", state)
+
+# Makes the next run of entityName refresh the full window (used after a replay loaded older data)
+def requireFullRefresh(entityName):
+	state = RunState.load("RefreshWindow")
+	state.get(entityName, {}).pop("lastFullRefresh", None)
+	RunState.save("RefreshWindow", state)
+
+# END OF FILE
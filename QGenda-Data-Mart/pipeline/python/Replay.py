@@ -0,0 +1,144 @@
+#   FILE HEADER
+#       File Name:  Replay.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the offline replay of an archived run.  QGendaMain.py --replay <run>
+#       reloads the data mart from the payloads archived by that run (see Archive.py) instead of calling
+#       the QGenda REST API: a ReplayClient stands in for the QGendaClient and serves each endpoint from
+#       its .json.gz archive, so the loaders, decoders and change detection run unchanged.  This is used
+#       to rebuild the tables after a database restore and to reproduce a failed run without the API.
+#
+#   TECHNICAL Notes
+#       - A run is found through its Manifest_<run timestamp>.json, which maps every archived endpoint
+#         URL to its file and keeps the run parameters (company, refresh windows, TimeEvent watermark),
+#         so the loaders request exactly the URLs the run requested
+#       - <run> is a run timestamp (2024-05-01_060000), a date (latest run of that day) or "latest"
+#       - An endpoint that was not archived (failed download, Schedule chunk that failed) raises
+#         FileNotFoundError, which fails that loader or chunk like an API error would
+#       - Responses are read from the archive in chunks, so a streamed loader never holds the whole body
+
+import Archive
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+
+# Returns the manifest of the run, with the archive folder it was read from under "path"
+def loadManifest(run="latest", path=Archive.archivePath):
+	fileNames = sorted(entry.name for entry in os.scandir(path) if entry.is_file() and entry.name.startswith("Manifest_") and entry.name.endswith(".json"))
+	if run != "latest":
+		fileNames = [fileName for fileName in fileNames if fileName[len("Manifest_"):].startswith(run)]
+	if not fileNames:
+		raise FileNotFoundError(f"No archived run matching {run!r} in {path}")
+
+	with open(path + fileNames[-1], "r", encoding="utf-8") as file:
+		manifest = json.load(file)
+	manifest["path"] = path
+	return manifest
+
+# Run parameter stored by Archive.setParameters() as an ISO date/datetime string
+def toDate(value):
+	return None if value is None else date.fromisoformat(value)
+
+def toDatetime(value):
+	return None if value is None else datetime.fromisoformat(value)
+
+# The parts of requests.Response used by the loaders
+class ReplayResponse:
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self.status_code = 200
+		self.encoding = "utf-8"
+		self.headers = {"Content-Type": "application/json"}
+		self._content = None
+
+	@property
+	def content(self):
+		if self._content is None:
+			with gzip.open(self.fileName, "rb") as file:
+				self._content = file.read()
+		return self._content
+
+	@property
+	def text(self):
+		return self.content.decode(self.encoding)
+
+	def json(self):
+		return json.loads(self.content)
+
+	def iter_content(self, chunk_size=65536, decode_unicode=False):
+		if self._content is not None:
+			data = self.text if decode_unicode else self._content
+			for start in range(0, len(data), chunk_size):
+				yield data[start:start + chunk_size]
+			return
+
+		with gzip.open(self.fileName, "rt" if decode_unicode else "rb", encoding=self.encoding if decode_unicode else None) as file:
+			while True:
+				chunk = file.read(chunk_size)
+				if not chunk:
+					break
+				yield chunk
+
+	def close(self):
+		pass
+
+# Serves the archived payloads of one run through the QGendaClient methods used by the loaders
+class ReplayClient:
+	def __init__(self, manifest):
+		self.path = manifest["path"]
+		self.runStamp = manifest["runStamp"]
+		self.files = manifest["files"]		# endPointURL -> file name
+
+		self._timingLock = threading.Lock()
+		self._timings = []		# (endpoint, seconds, bytes)
+		self._sharedLock = threading.Lock()
+		self._shared = {}		# endPointURL -> response
+
+	def get(self, endPointURL, useBuffer=True, stream=False):
+		fileName = self.files.get(endPointURL)
+		if fileName is None:
+			raise FileNotFoundError(f"Run {self.runStamp} did not archive {endPointURL.split('?')[0]} for this request")
+
+		requestStart = time.perf_counter()
+		response = ReplayResponse(self.path + fileName)
+		if not stream:
+			response.content		# Read now, like a buffered requests.Response
+		seconds = time.perf_counter() - requestStart
+
+		size = os.path.getsize(response.fileName)
+		with self._timingLock:
+			self._timings.append((endPointURL.split("?")[0], seconds, size))
+		return response
+
+	# Nothing to retry offline
+	def getWithRetry(self, endPointURL, attempts=3, backoff=2.0, stream=False):
+		return self.get(endPointURL, stream=stream)
+
+	# archiveName is not used: nothing is archived again during a replay
+	def getShared(self, endPointURL, archiveName):
+		with self._sharedLock:
+			if endPointURL not in self._shared:
+				self._shared[endPointURL] = self.get(endPointURL)
+			return self._shared[endPointURL]
+
+	def buffer(self, endPointURL, response):
+		pass
+
+	def close(self):
+		with self._sharedLock:
+			self._shared = {}
+
+	def getTimings(self):
+		listLog = []
+		with self._timingLock:
+			for endpoint, seconds, size in self._timings:
+				log = "(" + str(datetime.today()) + f")  REPLAY {endpoint}:  run {self.runStamp}, {seconds:.3f}s, {size} bytes compressed\n"
+				listLog.append(log)
+		return listLog
+
+# END OF FILE
@@ -0,0 +1,46 @@
+#   FILE HEADER
+#       File Name:  RunState.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       This python script defines the small persistent state kept between QGenda Data Mart runs, such
+#       as the TimeEvent high-water marks.  Each state is a JSON document stored under its own name in
+#       the state folder next to the digest sidecars (see DiffEngine.py).
+#
+#   TECHNICAL Notes
+#       - load() returns an empty dictionary when the state does not exist or cannot be parsed, so a lost
+#         or damaged state file only costs a full refresh
+#       - save() writes to a temporary file and renames it over the old one, so a crash never leaves a
+#         half-written state
+#       - Datetimes are stored as ISO 8601 strings; toDatetime()/fromDatetime() convert them
+#       - Loaders run on separate threads but each state name is written by a single loader
+
+import json
+import os
+from datetime import datetime
+
+statePath = os.path.join("C:\\", "Users", "Public", "ANES ETL", "QGenda Data Mart", "state", "")
+
+def load(name):
+	try:
+		with open(statePath + name + ".json", "r", encoding="utf-8") as file:
+			state = json.load(file)
+	except (OSError, ValueError):
+		return {}
+	return state if isinstance(state, dict) else {}
+
+def save(name, state):
+	os.makedirs(statePath, exist_ok=True)
+	fileName = statePath + name + ".json"
+	with open(fileName + ".tmp", "w", encoding="utf-8") as file:
+		json.dump(state, file, indent=1, sort_keys=True)
+	os.replace(fileName + ".tmp", fileName)
+
+def fromDatetime(value):
+	return value.isoformat() if value is not None else None
+
+def toDatetime(value):
+	return datetime.fromisoformat(value) if value else None
+
+# END OF FILE
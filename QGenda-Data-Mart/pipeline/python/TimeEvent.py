@@ -6,344 +6,120 @@
 #   DESCRIPTION
 #       This python script defines a function which acquires QGenda Time Event records via the QGenda
 #       REST API.  This file can only execute successfully in environments with ODBC connections 
-#       defined  that match the DSNs in the pyodbc connection strings.
+#       defined  that match the DSNs requested from the ConnectionPool.
 #
 #	QGenda REST API (https://restapi.qgenda.com/)
 #   Endpoint: TimeEvent (https://restapi.qgenda.com/#f61c3c47-8597-4f9e-92d5-f059c149dc2c)
-
-import os
-import pyodbc
-import requests
-from datetime import date, datetime, timedelta
-
-def getTimeEvent(token, companyKey, startDate, endDate):
-    # BLOCK 01 | Initialization
-    #
-    #	- Initialize ODBC connections
-    #	- Configuration for connecting to QGenda REST API
-    #	- Request and store access token
-
-	processStart = datetime.today()
-    
-	importTableName = "import.qdm_TimeEvent"
-	stageTableName = "stage.qdm_TimeEvent"
-	prodTableName = "dbo.TimeEvent"
-
-	listLog = ["TimeEvent.getTimeEvent() commencing\n", f"Process Start Timestamp: {str(processStart)}\n"]
-	listLog.append("\n\nETL PHASE: Initialization\n\n")
-
-	ETL = pyodbc.connect('DSN=ETL1')
-	Core = pyodbc.connect('DSN=Core;Database=QGenda')
-	listLog.append("ODBC connections opened\n")
-
-
-    # BLOCK 02 | Retreving data from TimeEvent Endpoint
-    #
-    #	- Prepare request parameters
-    #   - Submit request to QGenda API
-    #	- Truncate (clear) [import.TimeEvent]
-    #	- Store data in ETLServer
-
-	log = "\n\nETL PHASE: Data retrieval from QGenda API\n\n"
-	print(log)
-	listLog.append(log)
-
-	log = "(" + str(datetime.today()) + ")  Preparing API request\n"
-	print(log, end="\n")
-	listLog.append(log)
-
+#
+#   TECHNICAL Notes
+#       - The refresh itself is EntityLoader.refreshDimension(); this file declares the TimeEvent spec
+#       - The window is requested in a single streamed request: records are decoded while the body
+#         downloads and inserted in batches
+#       - isFullWindow False (backfill partition) only updates the sidecar and leaves the watermark
+#         alone, since its newest LastModifiedDate says nothing about the rolling window
+
+import ApiDecoder
+import EntityLoader
+import RunState
+from datetime import datetime, timedelta
+
+# Incremental sync: between full refreshes only records modified since the last successful run are
+# requested.  The high-water mark is the newest LastModifiedDate seen, kept per companyKey in RunState
+fullSyncIntervalDays = 7		# A full-window run also removes records deleted in QGenda
+watermarkOverlap = timedelta(hours=6)
+
+# API field and conversion of each [import.qdm_TimeEvent] column (formerly OPENJSON in usp_TimeEventAPI)
+importSchema = [
+	("ScheduleEntryKey", ApiDecoder.toGuid), ("TaskShiftKey", ApiDecoder.toGuid), ("StaffKey", ApiDecoder.toGuid), ("TaskKey", ApiDecoder.toGuid),
+	("TimePunchEventKey", ApiDecoder.toInt), ("Date", ApiDecoder.toDate()), ("DayOfWeek", ApiDecoder.toInt),
+	("ActualClockInLocal", ApiDecoder.toSmallDatetime(19)), ("EffectiveClockInLocal", ApiDecoder.toSmallDatetime(19)),
+	("ActualClockOutLocal", ApiDecoder.toSmallDatetime(19)), ("EffectiveClockOutLocal", ApiDecoder.toSmallDatetime(19)), ("Duration", ApiDecoder.toInt),
+	("IsStruck", ApiDecoder.toFlag), ("IsEarly", ApiDecoder.toFlag), ("IsLate", ApiDecoder.toFlag), ("IsExcessiveDuration", ApiDecoder.toFlag),
+	("IsExtended", ApiDecoder.toFlag), ("IsUnplanned", ApiDecoder.toFlag), ("FlagsResolved", ApiDecoder.toFlag),
+	("Notes", ApiDecoder.toText(255)), ("LastModifiedDate", ApiDecoder.toSmallDatetime(19))
+]
+
+# Returns the LastModifiedDate to request records from, or None when this run must cover the full window
+def getModifiedSince(companyKey, now=None):
+	now = now or datetime.today()
+	state = RunState.load("TimeEvent").get(companyKey, {})
+	watermark = RunState.toDatetime(state.get("watermark"))
+	lastFullSync = RunState.toDatetime(state.get("lastFullSync"))
+	if watermark is None or lastFullSync is None or now - lastFullSync >= timedelta(days=fullSyncIntervalDays):
+		return None
+	return watermark - watermarkOverlap
+
+# Makes the next run cover the full window again (used after a replay loaded older data)
+def requireFullSync(companyKey):
+	runState = RunState.load("TimeEvent")
+	runState.get(companyKey, {}).pop("lastFullSync", None)
+	RunState.save("TimeEvent", runState)
+
+# TimeEvent is not prefetched by QGendaMain.py: its response is streamed (see spec "stream")
+def getEndPointURL(companyKey, startDate, endDate, modifiedSince=None):
 	fStartDate = startDate.strftime("%m/%d/%Y")
 	fEndDate = endDate.strftime("%m/%d/%Y")
-	rootURL = "https://api.qgenda.com/v2"
 	endPointURL = f"/timeevent/?companyKey={companyKey}&startDate={fStartDate}&endDate={fEndDate}&$select=ScheduleEntryKey,TaskShiftKey,StaffKey,TaskKey,TimePunchEventKey,Date,DayOfWeek,ActualClockInLocal,EffectiveClockInLocal,ActualClockOutLocal,EffectiveClockOutLocal,Duration,IsStruck,IsEarly,IsLate,IsExcessiveDuration,IsExtended,IsUnplanned,FlagsResolved,Notes,LastModifiedDate"
-	getURL = rootURL + endPointURL
-	payload={}
-	headers = {
-		'Authorization': f'bearer {token}'
+	if modifiedSince is not None:
+		endPointURL += "&$filter=LastModifiedDate ge " + modifiedSince.strftime("%Y-%m-%dT%H:%M:%S")
+	return endPointURL
+
+# Column order shared by [import.qdm_TimeEvent] and [dbo.TimeEvent]
+columns = [
+	"ScheduleEntryKey", "TaskShiftKey", "StaffKey", "TaskKey", "TimePunchEventKey", "TimeEventDate", "TimeEventWeekday",
+	"ActualClockIn", "EffectiveClockIn", "ActualClockOut", "EffectiveClockOut", "Duration", "IsStruck", "IsEarly", "IsLate",
+	"IsExcessiveDuration", "IsExtended", "IsUnplanned", "FlagsResolved", "Notes", "LastModifiedDate"
+]
+# Columns compared to detect an updated record (same columns as import.usp_DoStagingTimeEvent)
+compareColumns = ["ScheduleEntryKey", "ActualClockIn", "EffectiveClockIn", "ActualClockOut", "EffectiveClockOut", "Notes", "LastModifiedDate"]
+
+struckIndex = columns.index("IsStruck")
+actualClockOutIndex = columns.index("ActualClockOut")
+effectiveClockOutIndex = columns.index("EffectiveClockOut")
+lastModifiedIndex = columns.index("LastModifiedDate")
+
+# Struck and incomplete (no clock out) records are removed from the import and deleted from prod
+def dropRow(row):
+	isIncomplete = row[actualClockOutIndex] is None and row[effectiveClockOutIndex] is None
+	return row[struckIndex] == 'T' or isIncomplete
+
+# Advances the watermark to the newest LastModifiedDate loaded; called once every row reached prod
+def advanceWatermark(window, rowsImport, processStart, listLog):
+	if not window["isFullWindow"]:
+		return
+
+	runState = RunState.load("TimeEvent")
+	companyState = runState.setdefault(window["companyKey"], {})
+	lastModifiedDates = [row[lastModifiedIndex] for row in rowsImport if row[lastModifiedIndex] is not None]
+	watermark = RunState.toDatetime(companyState.get("watermark"))
+	if watermark is not None:
+		lastModifiedDates.append(watermark)
+	if lastModifiedDates:
+		watermark = max(lastModifiedDates)
+	companyState["watermark"] = RunState.fromDatetime(watermark)
+	if window["modifiedSince"] is None:
+		companyState["lastFullSync"] = RunState.fromDatetime(processStart)
+	RunState.save("TimeEvent", runState)
+
+	log = "(" + str(datetime.today()) + f")  TimeEvent watermark for company set to {str(watermark)}\n"
+	print(log)
+	listLog.append(log)
+
+spec = {
+	"name": "TimeEvent", "label": "TIME EVENT", "functionName": "TimeEvent.getTimeEvent()",
+	"source": "window", "compare": "digest",
+	"archiveName": "TimeEvent", "importTable": "import.qdm_TimeEvent", "importSchema": importSchema,
+	"windowColumn": "TimeEventDate", "stream": True, "maxRequestWorkers": 1, "maxRequestAttempts": 1,
+	"prodTable": "dbo.TimeEvent", "keyColumn": "TimePunchEventKey", "columns": columns, "compareColumns": compareColumns, "dropRow": dropRow,
+	"onPushed": advanceWatermark,
+}
+
+# modifiedSince comes from getModifiedSince(), called by QGendaMain.py (or from the replayed run)
+def getTimeEvent(client, companyKey, startDate, endDate, pool, modifiedSince=None, isFullWindow=True, isolated=False):
+	window = {
+		"companyKey": companyKey, "startDate": startDate, "endDate": endDate, "isFullWindow": isFullWindow, "modifiedSince": modifiedSince, "isolated": isolated,
+		"requests": [(startDate, endDate, getEndPointURL(companyKey, startDate, endDate, modifiedSince))],
 	}
-        
-	log = "(" + str(datetime.today()) + ")  Requesting data from QGenda API.\n"
-	print(log)
-	listLog.append(log)
-
-	response = requests.get(getURL, headers=headers, data=payload)
-	
-	jsonPath = os.path.join("C:\\", "Users", "Public", "ANES ETL", "QGenda Data Mart", "json", "")
-	jsonFile = "TimeEvent_" + str(date.today()) + ".json"
-	with open (jsonPath + jsonFile, "w") as file:
-		file.write(response.text)
-
-	log = "(" + str(datetime.today()) + ")  Received TIME EVENT data from QGenda API\n\n"
-	print(log)
-	listLog.append(log)
-
-	log = "(" + str(datetime.today()) + f")  Submitting TRUNCATE command.  Target table: [ETLServer.StagingQGenda.{importTableName}]\n"
-	print(log)
-	listLog.append(log)
-	cursorETL = ETL.cursor()
-	cursorETL.execute("TRUNCATE TABLE " + importTableName + ";")
-	cursorETL.commit()
-
-	log = "(" + str(datetime.today()) + f")  Inserting records.  Target table: [ETLServer.StagingQGenda.{importTableName}]\n"
-	print(log)
-	listLog.append(log)
-
-	cursorETL.execute("{Call import.usp_TimeEventAPI (?)}", response.text)
-	# USP is defined in \QGenda-Data-Mart\pipeline\sql\TimeEvent\USP import,usp_TimeEventAPI.sql
-	cursorETL.commit()
-
-	log = "(" + str(datetime.today()) + ")  Data successfully transferred to ETLServer.\n"
-	print(log)
-	listLog.append(log)
-
-
-    # BLOCK 03 | Retrieving data from ProdServer
-    #
-    #	- This block retrieves records from ProdServer that fall into the refresh window of 30 days
-    #	- [stage.TimeEvent] is truncated in preparation for the new records
-    #	- The records retrieved from ProdServer are inserted into [stage.TimeEvent]
-    #	- The records retrieved from ProdServer are deleted from [ProdServer.dbo.TimeEvent] to prevent
-    #		duplicate records from existing after the new staged records have been inserted
-
-	log = "\n\nETL PHASE: Data retrieval from ProdServer\n\n"
-	print(log)
-	listLog.append(log)
-
-	log = "(" + str(datetime.today()) + f")  Retrieving records within refresh window from ProdServer.  Target table: [{prodTableName}]\n"
-	print(log)
-	listLog.append(log)
-
-	cursorCore = Core.cursor()
-	cursorCore.execute("""
-        SELECT 
-            ScheduleEntryKey
-            , TaskShiftKey
-            , StaffKey
-            , TaskKey
-            , TimePunchEventKey
-            , TimeEventDate
-            , TimeEventWeekday
-            , ActualClockIn
-            , EffectiveClockIn
-            , ActualClockOut
-            , EffectiveClockOut
-            , Duration
-            , IsStruck
-            , IsEarly
-            , IsLate
-            , IsExcessiveDuration
-            , IsExtended
-            , IsUnplanned
-            , FlagsResolved
-            , Notes
-            , LastModifiedDate
-            , NULL AS ETLCommand
-        FROM """ + prodTableName + """
-        WHERE TimeEventDate BETWEEN '""" + str(startDate) + "' AND '" + str(endDate) + """';
-    """)
-	rowsCore = cursorCore.fetchall()
-	rowsReturned = len(rowsCore)
-	log = "(" + str(datetime.today()) + f")  Retrieved {str(rowsReturned)} records from ProdServer\n\n"
-	print(log)
-	listLog.append(log)
-
-	if rowsReturned > 0:
-		log = "(" + str(datetime.today()) + f")  Preparing ETLServer for records.  Submitting TRUNCATE command.  Target table: [{stageTableName}]\n"
-		print(log)
-		listLog.append(log)
-		cursorETL.execute("TRUNCATE TABLE " + stageTableName + ";")
-		cursorETL.commit()
-        
-		log = "(" + str(datetime.today()) + f")  Inserting records retrieved from ProdServer.  Target table: [{stageTableName}]\n"
-		print(log)
-		listLog.append(log)
-		sql = """
-			INSERT INTO """ + stageTableName + """
-				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-		"""     # 22 columns
-		cursorETL.executemany(sql, rowsCore)
-		cursorETL.commit()
-
-		log = "(" + str(datetime.today()) + ")  Retrieval of records from ProdServer complete\n\n"
-		print(log)
-		listLog.append(log)
-	else:
-		log = "(" + str(datetime.today()) + f")  No records available from {prodTableName}] within the past 30 days\n"
-		print(log)
-		listLog.append(log)
-
-
-    # BLOCK 04 | Consolidate and stage records
-    #
-    #	- This block calls a USP that performs several tasks
-    #		1) Identifies and removes struck records from [stage.TimeEvent]
-    #		2) Inserts new records found in [import.TimeEvent] to [stage.TimeEvent]
-    #		3) Searches for newer values of existing records and updates
-    #			- Notes
-    #			- LastModifiedDate
-
-	log = "\n\nETL PHASE: Staging TimeEvent records\n\n"
-	print(log, end="\n")
-	listLog.append(log)
-
-	log = "(" + str(datetime.today()) + ")  Staging TIME EVENT data by calling [import.usp_DoStagingTimeEvent]\n"
-	print(log)
-	listLog.append(log)
-
-	cursorETL.execute("{CALL import.usp_DoStagingTimeEvent}")
-	# USP is defined in \QGenda-Data-Mart\pipeline\sql\TimeEvent\USP import,usp_DoStagingTimeEvent.sql
-	cursorETL.commit()
-
-	log = "(" + str(datetime.today()) + ")  Staging complete.\n"
-	print(log)
-	listLog.append(log)
-
-
-    # BLOCK 05 | Push staged records to production
-    #
-    #	- Transfers the freshly staged TimeEvent records to ProdServer
-    #	- Close ODBC connections
-
-	log = "\nETL PHASE: Pushing staged records to ProdServer\n"
-	print(log, end="\n")
-	listLog.append(log)
-
-	log = "(" + str(datetime.today()) + f")  Identifying records flagged for update or deletion.  Target: [ProdServer.QGenda.{stageTableName}]\n"
-	print(log)
-	listLog.append(log)
-
-	cursorETL.execute("""
-		SELECT DISTINCT
-			ScheduleEntryKey
-			, TaskShiftKey
-			, StaffKey
-			, TaskKey
-			, TimePunchEventKey
-			, TimeEventDate
-			, TimeEventWeekday
-			, ActualClockIn
-			, EffectiveClockIn
-			, ActualClockOut
-			, EffectiveClockOut
-			, Duration
-			, IsStruck
-			, IsEarly
-			, IsLate
-			, IsExcessiveDuration
-			, IsExtended
-			, IsUnplanned
-			, FlagsResolved
-			, Notes
-			, LastModifiedDate
-		FROM """ + stageTableName + """
-		WHERE ETLCommand IN ('Update', 'Delete')
-		ORDER BY TimeEventDate, ActualClockIn
-	""")
-	rowsETL = cursorETL.fetchall()
-	rowsReturned = len(rowsETL)
-
-	if rowsReturned > 0:
-		log = "(" + str(datetime.today()) + f")  Deleting {str(rowsReturned)} records flagged for deletion or update.  Target: [ProdServer.QGenda.{prodTableName}]\n"
-		print(log)
-		listLog.append(log)
-
-		i = 1
-		for row in rowsETL:
-			i += 1
-			if (i % 500) == 0:
-				print("Deleting records ...\n")
-			key = row.TimePunchEventKey
-			cursorCore.execute("DELETE FROM " + prodTableName + " WHERE TimePunchEventKey = ?", key)
-		cursorCore.commit()
-		log = "(" + str(datetime.today()) + ")  Records successfully deleted\n\n"
-		print(log)
-		listLog.append(log)
-	else:
-		log = "(" + str(datetime.today()) + f")  No record deletion required\n\n"
-		print(log)
-		listLog.append(log)
-
-	log = "(" + str(datetime.today()) + f")  Identifying new and updated records.  Target: [ProdServer.QGenda.{prodTableName}]\n"
-	print(log)
-	listLog.append(log)
-
-	cursorETL.execute("""
-		SELECT DISTINCT
-			ScheduleEntryKey
-			, TaskShiftKey
-			, StaffKey
-			, TaskKey
-			, TimePunchEventKey
-			, TimeEventDate
-			, TimeEventWeekday
-			, ActualClockIn
-			, EffectiveClockIn
-			, ActualClockOut
-			, EffectiveClockOut
-			, Duration
-			, IsStruck
-			, IsEarly
-			, IsLate
-			, IsExcessiveDuration
-			, IsExtended
-			, IsUnplanned
-			, FlagsResolved
-			, Notes
-			, LastModifiedDate
-		FROM """ + stageTableName + """
-		WHERE ETLCommand IN ('New', 'Update')
-		ORDER BY TimeEventDate, ActualClockIn
-	""")
-	rowsETL = cursorETL.fetchall()
-	rowsReturned = len(rowsETL)
-
-	if rowsReturned > 0:
-		log = "(" + str(datetime.today()) + f")  Inserting records flagged as new or updated.  Target: [ProdServer.QGenda.{prodTableName}]\n"
-		print(log)
-		listLog.append(log)
-
-		
-		sql = """
-			INSERT INTO """ + prodTableName + """
-				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
-		# Column Counter                           10                            20
-		
-		cursorCore.executemany(sql, rowsETL)
-		cursorCore.commit()
-
-		log = "(" + str(datetime.today()) + ")  Staged TIME EVENT records successfully transferred\n"
-		print(log)
-		listLog.append(log)
-	else:
-		log = "(" + str(datetime.today()) + ")  No new or updated records identified, no transfer required\n"
-		print(log)
-		listLog.append(log)
-
-	processEnd = datetime.today()
-
-
-    # BLOCK 06 | Write log and clean up
-    #
-    #	- Close ODBC connections
-    #	- Write log to file
-
-	listLog.append("\n\nETL PHASE: Process clean-up\n")
-	ETL.close()
-	Core.close()
-
-	processDuration = processEnd - processStart
-
-	log = f"End process timestamp: {str(processEnd)}\n"
-	print(log)
-	listLog.append(log)
-
-	log = f"Process duration: {str(processDuration)}\n"
-	print(log)
-	listLog.append(log)
-
-	log = "TimeEvent.getTimeEvent() complete\n\n"
-	print(log)
-	listLog.append(log)
+	return EntityLoader.refreshDimension(client, pool, spec, window=window)
 
-	return 200, listLog
-# END OF FILE
\ No newline at end of file
+# END OF FILE
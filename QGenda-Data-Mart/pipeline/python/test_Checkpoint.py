@@ -0,0 +1,114 @@
+#   FILE HEADER
+#       File Name:  test_Checkpoint.py
+#       Author:     Matt C
+#       Project:    QGenda Data Mart
+#
+#   DESCRIPTION
+#       Tests that the QGendaRun checkpoint records the phase a loader failed in, whether the loader
+#       returned a failure status or raised part way through a phase.  Run with pytest from this folder.
+#
+#   TECHNICAL Notes
+#       - The pool and client are stand-ins that never touch a server; the EntityLoader tests need pyodbc
+#         installed (EntityLoader.py imports it) and are skipped otherwise
+#       - RunState is pointed at a temporary folder and archiving is turned off
+
+import contextlib
+import pytest
+import Checkpoint
+import Pipeline
+import RunState
+from datetime import date, datetime
+
+@pytest.fixture(autouse=True)
+def statePath(tmp_path, monkeypatch):
+	monkeypatch.setattr(RunState, "statePath", str(tmp_path) + "/")
+
+class FakeCursor:
+	def execute(self, sql, *parameters):
+		return self
+
+	def commit(self):
+		pass
+
+	def rollback(self):
+		pass
+
+class FakeConnection:
+	def cursor(self):
+		return FakeCursor()
+
+class FakePool:
+	def __init__(self):
+		self.leased = 0
+
+	@contextlib.contextmanager
+	def lease(self, dsn, database=None):
+		self.leased += 1
+		try:
+			yield FakeConnection()
+		finally:
+			self.leased -= 1
+
+class FailingClient:
+	def getShared(self, endPointURL, archiveName):
+		raise RuntimeError("connection reset while downloading")
+
+	def getWithRetry(self, endPointURL, attempts=3, backoff=2.0, stream=False):
+		raise RuntimeError("connection reset while downloading")
+
+def getSpec(source):
+	return {
+		"name": "Test", "label": "TEST", "functionName": "test_Checkpoint.getSpec()",
+		"source": source, "compare": "digest", "endPointURL": lambda: "/test",
+		"archiveName": "Test", "importTable": "import.qdm_Test", "importSchema": [],
+		"windowColumn": "TestDate", "stream": False, "maxRequestWorkers": 1, "maxRequestAttempts": 1,
+	}
+
+def runAndCheckpoint(function):
+	state = Checkpoint.start(datetime.today())
+	loaders = [{"name": "Test", "function": function, "dependsOn": []}]
+	results = Pipeline.runLoaders(loaders, maxWorkers=1, onComplete=lambda loader, status, listLog: Checkpoint.recordLoader(state, loader["name"], status, listLog))
+	return results[0][1], Checkpoint.load()["loaders"]["Test"]
+
+def test_raisedLoaderKeepsItsPhases():
+	def loader():
+		listLog = ["\n\nETL PHASE: Initialization\n\n", "\n\nETL PHASE: Data retrieval from QGenda API\n\n"]
+		error = RuntimeError("connection reset while downloading")
+		error.listLog = listLog
+		raise error
+
+	status, checkpoint = runAndCheckpoint(loader)
+	assert status == 500
+	assert checkpoint["failedPhase"] == "Data retrieval from QGenda API"
+	assert [phase["phase"] for phase in checkpoint["phases"]] == ["Initialization", "Data retrieval from QGenda API"]
+
+def test_failedStatusIsNotRecordedAsCleanUp(monkeypatch):
+	pytest.importorskip("pyodbc")
+	import Archive
+	import EntityLoader
+	monkeypatch.setattr(Archive, "enabled", False)
+
+	pool = FakePool()
+	window = {
+		"companyKey": "test", "startDate": date(2024, 1, 1), "endDate": date(2024, 1, 7), "isFullWindow": True, "modifiedSince": None, "isolated": False,
+		"requests": [(date(2024, 1, 1), date(2024, 1, 7), "/test")],
+	}
+	status, checkpoint = runAndCheckpoint(lambda: EntityLoader.refreshDimension(FailingClient(), pool, getSpec("window"), window=window))
+	assert status == 400
+	assert checkpoint["failedPhase"] == "Data retrieval from QGenda API"
+	assert checkpoint["phases"][-1]["phase"] == "Process clean-up"
+	assert pool.leased == 0
+
+def test_raisedRefreshRecordsItsPhase(monkeypatch):
+	pytest.importorskip("pyodbc")
+	import Archive
+	import EntityLoader
+	monkeypatch.setattr(Archive, "enabled", False)
+
+	pool = FakePool()
+	status, checkpoint = runAndCheckpoint(lambda: EntityLoader.refreshDimension(FailingClient(), pool, getSpec("shared")))
+	assert status == 500
+	assert checkpoint["failedPhase"] == "Data retrieval from QGenda API"
+	assert pool.leased == 0
+
+# END OF FILE
@@ -9,6 +9,9 @@
  *		- Accepts a single argument @json, which is a JSON string
  *	 	- Truncates any existing data prior to ETL
  *		- Parses the data passed in to the USP and inserts records into [import.qdm_Schedule]
+ *
+ *		NOTE: The pipeline no longer calls this USP.  The records are decoded in python/Schedule.py
+ *		(importSchema, see python/ApiDecoder.py) and bulk inserted; this definition is kept for manual loads.
  */
  
 ALTER PROCEDURE import.usp_ScheduleAPI ( @json NVARCHAR(MAX) )
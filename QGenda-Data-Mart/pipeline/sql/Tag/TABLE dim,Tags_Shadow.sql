@@ -0,0 +1,50 @@
+/*	FILE HEADER
+ *		File Name:	TABLE dim,Tags_Shadow.sql
+ *		Author:		Matt Chansard
+ *		Project:	QGenda Data Mart
+ *
+ *	DESCRIPTION
+ *		This file defines the shadow table for [dim.Tag].  When a loader runs with
+ *		refreshMode="swap" the full dimension is bulk loaded here and switched into [dim.Tag]
+ *		with ALTER TABLE ... SWITCH.  It must keep exactly the same columns and indexes as
+ *		[dim.Tag].
+ */
+
+
+-- Connect to ANESCore
+USE QGenda;
+
+DROP TABLE IF EXISTS dim.Tag_Shadow;
+GO
+CREATE TABLE dim.Tag_Shadow
+(
+	CategoryKey							BIGINT
+	, CategoryName						NVARCHAR(30)
+	, CategoryCreatedDateTime			DATETIME
+	, CategoryModifiedDateTime			DATETIME
+	, TagKey							BIGINT			PRIMARY KEY NONCLUSTERED
+	, TagName							NVARCHAR(30)
+	, TagCreatedDateTime				DATETIME
+	, TagModifiedDateTime				DATETIME
+	, IsAvailableForCreditAllocation	NCHAR(1)
+	, IsAvailableForHoliday				NCHAR(1)
+	, IsAvailableForLocation			NCHAR(1)
+    , IsAvailableForProfile				NCHAR(1)
+    , IsAvailableForRequestLimit		NCHAR(1)
+    , IsAvailableForScheduleEntry		NCHAR(1)
+    , IsAvailableForSeries				NCHAR(1)
+    , IsAvailableForStaff				NCHAR(1)
+    , IsAvailableForStaffLocation		NCHAR(1)
+    , IsAvailableForStaffTarget			NCHAR(1)
+    , IsAvailableForTask				NCHAR(1)
+    , IsFilterOnAdmin					NCHAR(1)
+    , IsFilterEverywhereExceptAdmin		NCHAR(1)
+    , IsPermissionCategory				NCHAR(1)
+    , IsSingleTaggingOnly				NCHAR(1)
+    , IsTTCMCategory					NCHAR(1)
+    , IsUsedForFiltering				NCHAR(1)
+    , IsUsedForStats					NCHAR(1)
+);
+	-- 26 columns
+
+-- END OF FILE --
\ No newline at end of file
@@ -13,6 +13,9 @@
  *
  *		Depending on whether @type = 'Staff' or 'Task', the JSON string in @json is read into
  *		[import.TagsAPI] differently.
+ *
+ *		NOTE: The pipeline no longer calls this USP.  The records are decoded in python/TagStaff.py/TagTask.py
+ *		(importSchema, see python/ApiDecoder.py) and bulk inserted; this definition is kept for manual loads.
  */
 
 ALTER PROCEDURE import.usp_AppliedTagsAPI
@@ -0,0 +1,33 @@
+/*	FILE HEADER
+ *		File Name:	TABLE dim,Task_Shadow.sql
+ *		Author:		Matt Chansard
+ *		Project:	QGenda Data Mart
+ *
+ *	DESCRIPTION
+ *		This file defines the shadow table for [dim.Task].  When a loader runs with
+ *		refreshMode="swap" the full dimension is bulk loaded here and switched into [dim.Task]
+ *		with ALTER TABLE ... SWITCH.  It must keep exactly the same columns and indexes as
+ *		[dim.Task].
+ */
+
+USE QGenda;
+DROP TABLE IF EXISTS dim.Task_Shadow;
+GO
+CREATE TABLE dim.Task_Shadow
+(
+	TaskKey					UNIQUEIDENTIFIER
+	, TaskName				NVARCHAR(50)		-- Originally named [Name]
+	, TaskId				NVARCHAR(50)
+	, TaskAbbrev			NVARCHAR(50)		-- Originally named [Abbrev]
+	, TaskType				NVARCHAR(15)		-- Originally named [Type]
+	, DepartmentId			NVARCHAR(15)
+	, EmrId					NVARCHAR(15)
+	, StartDate				DATE
+	, EndDate				DATE
+	, ContactInformation	NVARCHAR(50)
+	, IsManual				NCHAR(1)			-- Originally named [Manual]
+	, RequireTimePunch		NCHAR(1)
+	, Notes					NVARCHAR(255)
+);
+
+-- END OF FILE --
\ No newline at end of file
@@ -9,6 +9,9 @@
  *		- Accepts a single argument @Json, which is a JSON string
  *	 	- Truncates any existing data prior to ETL
  *	 	- Parses the data passed in to the USP (@json) and inserts records into [import.qdm_Task]
+ *
+ *		NOTE: The pipeline no longer calls this USP.  The records are decoded in python/Task.py
+ *		(importSchema, see python/ApiDecoder.py) and bulk inserted; this definition is kept for manual loads.
  */
 
 